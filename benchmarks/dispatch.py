@@ -0,0 +1,93 @@
+# USAGE
+# python -m benchmarks.dispatch --items 200000 --jobs 1 4 --chunks 1 16 64
+
+# import the necessary packages
+from ui.eventemitter import EventEmitter
+from ui.parallelizer import Parallelizer
+import threading
+import argparse
+import time
+
+
+def perItemDispatch(items, jobs, handler):
+    # the loop Parallelizer threads used to run: the items lock, a pause
+    # and cancel event check, a listeners list and a fresh cancellation
+    # checker for every single item
+    (items, itemsLock) = (iter(items), threading.Lock())
+
+    def worker():
+        (threadEvent, cancelledEvent, notPausedEvent) = (
+            EventEmitter(), threading.Event(), threading.Event())
+        notPausedEvent.set()
+
+        def newConstraintChecker(listeners):
+            def checkConstraint(handle=None, persist=False):
+                if handle:
+                    with cancelledEvent._cond:
+                        if not persist:
+                            listeners.append(handle)
+                        threadEvent.on("cancel", handle)
+                else:
+                    return cancelledEvent.isSet()
+            return checkConstraint
+
+        while not cancelledEvent.isSet():
+            notPausedEvent.wait()
+            listeners = []
+            try:
+                try:
+                    with itemsLock:
+                        item = next(items)
+                except StopIteration:
+                    break
+                threadEvent.emit(
+                    "result", handler(item, newConstraintChecker(listeners)))
+            finally:
+                for listener in listeners:
+                    threadEvent.removeListener("cancel", listener)
+
+    threads = [threading.Thread(target=worker) for _ in range(jobs)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def handler(item, doCancel):
+    # a tiny job, like pushing a student row, that checks for cancellation
+    doCancel()
+
+
+def timed(dispatch):
+    started = time.perf_counter()
+    dispatch()
+    return time.perf_counter() - started
+
+
+if __name__ == "__main__":
+    # construct the argument parser and parse the arguments
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-n", "--items", type=int, default=200000,
+                    help="number of tiny items to dispatch")
+    ap.add_argument("-j", "--jobs", type=int, nargs="+", default=[1, 4],
+                    help="thread counts to benchmark")
+    ap.add_argument("-c", "--chunks", type=int, nargs="+", default=[1, 16, 64],
+                    help="items taken per lock acquisition to benchmark")
+    args = vars(ap.parse_args())
+
+    def runParallelizer(jobs, chunksize):
+        par = Parallelizer(
+            range(args["items"]), jobs, handler, chunksize=chunksize)
+        par.start()
+        par.joinAll()
+
+    print("{:>5} {:>14} {:>12}".format("jobs", "dispatch", "items/s"))
+    for jobs in args["jobs"]:
+        elapsed = timed(lambda: perItemDispatch(
+            range(args["items"]), jobs, handler))
+        print("{:>5} {:>14} {:>12.0f}".format(
+            jobs, "per-item", args["items"] / elapsed))
+        for chunksize in args["chunks"]:
+            elapsed = timed(lambda: runParallelizer(jobs, chunksize))
+            print("{:>5} {:>14} {:>12.0f}".format(
+                jobs, "chunks of %d" % chunksize, args["items"] / elapsed))
@@ -0,0 +1,77 @@
+# USAGE
+# python -m benchmarks.enrollment --detector core/face_detection_model \
+#	--embedding-model core/openface_nn4.small2.v1.t7 --backend cosine
+
+# import the necessary packages
+from xrecogcore import XRecogCore
+import numpy as np
+import argparse
+import tempfile
+import time
+import os
+
+
+def syntheticFaces(matricCode, n):
+    # `n` noisy unit embeddings around a random identity
+    identity = np.random.randn(128)
+    vectors = identity + 0.1 * np.random.randn(n, 128)
+    return [vector / np.linalg.norm(vector) for vector in vectors.astype("float32")]
+
+
+if __name__ == "__main__":
+    # construct the argument parser and parse the arguments
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-d", "--detector", default="core/face_detection_model",
+                    help="path to OpenCV's deep learning face detector")
+    ap.add_argument("-m", "--embedding-model", default="core/openface_nn4.small2.v1.t7",
+                    help="path to OpenCV's deep learning face embedding model")
+    ap.add_argument("-b", "--backend", default="cosine",
+                    help="recognizer backend to enroll into (svc or cosine)")
+    ap.add_argument("-n", "--identities", type=int, nargs="+", default=[100, 1000, 10000],
+                    help="gallery sizes to benchmark")
+    ap.add_argument("-r", "--registrations", type=int, default=20,
+                    help="number of students to register on top of each gallery")
+    ap.add_argument("-i", "--images", type=int, default=12,
+                    help="number of face images per student")
+    args = vars(ap.parse_args())
+
+    print("{:>10} {:>18} {:>22}".format(
+        "identities", "full retrain ms", "incremental ms/student"))
+    for nIdentities in args["identities"]:
+        with tempfile.TemporaryDirectory() as pickleDir:
+            core = XRecogCore(
+                detector=args["detector"],
+                embedding_model=args["embedding_model"],
+                confidence=0.5,
+                backend=args["backend"],
+                prepareBaseFacialVectors=lambda addImage: {},
+                pickleMaps={
+                    "embeddings": os.path.join(pickleDir, "embeddings"),
+                    "recognizer": os.path.join(pickleDir, "recognizer.pickle")
+                })
+
+            # enroll the base gallery, timing the full retrain which
+            # every registration used to pay for
+            for index in range(nIdentities):
+                matricCode = "%06d" % index
+                core.addVectors(matricCode, syntheticFaces(
+                    matricCode, args["images"]))
+            start = time.perf_counter()
+            core.quantifyFaces()
+            retrain = (time.perf_counter() - start) * 1000
+
+            # register new students one at a time
+            start = time.perf_counter()
+            for index in range(nIdentities, nIdentities + args["registrations"]):
+                matricCode = "%06d" % index
+                core.addVectors(matricCode, syntheticFaces(
+                    matricCode, args["images"]))
+                core.quantifyFaces(matricCode)
+            incremental = (time.perf_counter() - start) * \
+                1000 / args["registrations"]
+
+            # let the background consolidation finish before cleaning up
+            core.consolidate()
+
+        print("{:>10} {:>18.2f} {:>22.3f}".format(
+            nIdentities, retrain, incremental))
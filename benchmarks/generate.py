@@ -0,0 +1,34 @@
+# USAGE
+# python -m benchmarks.generate --students 100000
+
+# import the necessary packages
+from ui.__main__ import generateStudents
+import argparse
+import time
+import os
+
+
+if __name__ == "__main__":
+    # construct the argument parser and parse the arguments
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-n", "--students", type=int, default=100000,
+                    help="number of decoy students to generate")
+    ap.add_argument("-t", "--threads", type=int, default=None,
+                    help="number of threads for the thread backend (demo default if unset)")
+    ap.add_argument("-p", "--processes", type=int, default=os.cpu_count(),
+                    help="number of worker processes for the process backend")
+    args = vars(ap.parse_args())
+
+    print("{:>8} {:>6} {:>10} {:>14}".format(
+        "backend", "jobs", "seconds", "students/s"))
+    for (backend, jobs) in (("thread", args["threads"]), ("process", args["processes"])):
+        started = time.perf_counter()
+        students = generateStudents(
+            args["students"], jobs=jobs, processes=backend == "process")
+        elapsed = time.perf_counter() - started
+
+        assert len(students) == args["students"]
+        assert len({student["matriculationCode"]
+                   for student in students}) == args["students"]
+        print("{:>8} {:>6} {:>10.2f} {:>14.0f}".format(
+            backend, jobs or "-", elapsed, len(students) / elapsed))
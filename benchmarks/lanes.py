@@ -0,0 +1,59 @@
+# USAGE
+# python -m benchmarks.lanes --workers 4 --loads 200 --marks 200
+
+# import the necessary packages
+from ui.parallelizer import WorkPool
+import argparse
+import time
+
+
+def busy(seconds):
+    # hold the worker (and the GIL) for `seconds`, like a batch of
+    # students being loaded into the tables
+    until = time.perf_counter() + seconds
+    while time.perf_counter() < until:
+        pass
+
+
+def run(workers, loads, marks, loadTime, markInterval, prioritized):
+    # queue every load up front, then mark a student every
+    # `markInterval` seconds while they're worked through
+    pool = WorkPool(workers)
+    (markLane, loadLane) = (pool.lane("mark", 0),
+                            pool.lane("load", 2 if prioritized else 0))
+    loadJobs = [loadLane.submit(busy, loadTime) for _ in range(loads)]
+    markJobs = []
+    for _ in range(marks):
+        markJobs.append(markLane.submit(busy, 0))
+        time.sleep(markInterval)
+    for job in loadJobs + markJobs:
+        job.result()
+    stats = pool.stats()
+    pool.shutdown()
+    return stats
+
+
+if __name__ == "__main__":
+    # construct the argument parser and parse the arguments
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-w", "--workers", type=int, default=4,
+                    help="number of threads in the pool")
+    ap.add_argument("-l", "--loads", type=int, default=200,
+                    help="number of bulk load jobs queued at once")
+    ap.add_argument("-m", "--marks", type=int, default=200,
+                    help="number of marks submitted while loading")
+    ap.add_argument("-t", "--load-time", type=float, default=0.005,
+                    help="seconds each load job keeps a worker busy")
+    ap.add_argument("-i", "--mark-interval", type=float, default=0.002,
+                    help="seconds between marks")
+    args = vars(ap.parse_args())
+
+    print("{:>12} {:>6} {:>10} {:>10} {:>10}".format(
+        "scheduling", "lane", "mean ms", "p95 ms", "max ms"))
+    for prioritized in (False, True):
+        stats = run(args["workers"], args["loads"], args["marks"],
+                    args["load_time"], args["mark_interval"], prioritized)
+        for lane in ("mark", "load"):
+            print("{:>12} {:>6} {:>10.2f} {:>10.2f} {:>10.2f}".format(
+                "priority" if prioritized else "fifo", lane,
+                stats[lane]["meanWait"], stats[lane]["p95Wait"], stats[lane]["maxWait"]))
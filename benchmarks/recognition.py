@@ -0,0 +1,94 @@
+# USAGE
+# python -m benchmarks.recognition --detector core/face_detection_model \
+#	--embedding-model core/openface_nn4.small2.v1.t7
+
+# import the necessary packages
+from xrecogcore import XRecogCore
+import numpy as np
+import argparse
+import tempfile
+import time
+import os
+
+
+def syntheticFrame(nFaces, size=60, width=600):
+    # tile `nFaces` random face-sized patches across a frame that is
+    # `width` pixels wide, growing its height as necessary
+    perRow = width // size
+    rows = -(-nFaces // perRow)
+    frame = np.random.randint(
+        0, 256, (rows * size, width, 3), dtype="uint8")
+    boxes = [
+        ((i % perRow) * size, (i // perRow) * size,
+         (i % perRow + 1) * size, (i // perRow + 1) * size)
+        for i in range(nFaces)]
+    return (frame, boxes)
+
+
+def recognizeSerially(core, frame, boxes):
+    # the pre-batching path: one embedder and one classifier call per face
+    for box in boxes:
+        (kept, vectors) = core.embedFaces(frame, [box])
+        list(zip(kept, *core.classifyFaces(vectors)))
+
+
+def recognizeBatched(core, frame, boxes):
+    list(core.recognizeFaces(frame, boxes))
+
+
+def timeFrames(fn, core, frame, boxes, frames):
+    fn(core, frame, boxes)
+    start = time.perf_counter()
+    for _ in range(frames):
+        fn(core, frame, boxes)
+    return (time.perf_counter() - start) * 1000 / frames
+
+
+if __name__ == "__main__":
+    # construct the argument parser and parse the arguments
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-d", "--detector", default="core/face_detection_model",
+                    help="path to OpenCV's deep learning face detector")
+    ap.add_argument("-m", "--embedding-model", default="core/openface_nn4.small2.v1.t7",
+                    help="path to OpenCV's deep learning face embedding model")
+    ap.add_argument("-f", "--frames", type=int, default=20,
+                    help="number of frames to average over")
+    ap.add_argument("-n", "--faces", type=int, nargs="+", default=[1, 10, 50],
+                    help="face counts to benchmark")
+    ap.add_argument("-b", "--backend", default="svc",
+                    help="recognizer backend to classify with (svc or cosine)")
+    ap.add_argument("-k", "--classes", type=int, default=50,
+                    help="number of enrolled identities to classify against")
+    args = vars(ap.parse_args())
+
+    with tempfile.TemporaryDirectory() as pickleDir:
+        core = XRecogCore(
+            detector=args["detector"],
+            embedding_model=args["embedding_model"],
+            confidence=0.5,
+            backend=args["backend"],
+            prepareBaseFacialVectors=lambda addImage: {},
+            pickleMaps={
+                "embeddings": os.path.join(pickleDir, "embeddings"),
+                "recognizer": os.path.join(pickleDir, "recognizer.pickle")
+            })
+
+    # train the recognizer on random unit embeddings for `classes` identities
+    print("[INFO] training recognizer on {} synthetic identities...".format(
+        args["classes"]))
+    vectors = np.random.randn(args["classes"] * 4, 128).astype("float32")
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    classes = ["%04d" % i for i in range(args["classes"])]
+    labels = np.arange(len(vectors), dtype="int32") % args["classes"]
+    core.recognizer.fit(classes, labels, vectors)
+
+    print("{:>6} {:>14} {:>14} {:>8}".format(
+        "faces", "serial ms/frm", "batched ms/frm", "speedup"))
+    for nFaces in args["faces"]:
+        (frame, boxes) = syntheticFrame(nFaces)
+        serial = timeFrames(recognizeSerially, core,
+                            frame, boxes, args["frames"])
+        batched = timeFrames(recognizeBatched, core,
+                             frame, boxes, args["frames"])
+        print("{:>6} {:>14.2f} {:>14.2f} {:>7.2f}x".format(
+            nFaces, serial, batched, serial / batched))
@@ -0,0 +1,63 @@
+# USAGE
+# python -m benchmarks.search --students 100000
+
+# import the necessary packages
+from ui.__main__ import COURSES, generateStudents
+from ui.searchindex import SearchIndex
+import argparse
+import time
+
+
+def scanMatches(students, query):
+    # the per-student matching the search box used to do, every field
+    # of every student split and compared against every query word
+    return {
+        student["matriculationCode"]
+        for student in students
+        if all(any(
+            text in part
+            for value in [student["firstName"], student["middleName"], student["lastName"],
+                          str(student["entryYear"]), student["matriculationCode"],
+                          COURSES[student["courseOfStudy"]]]
+            for part in filter(bool, value.lower().split(' '))
+        ) for text in query)
+    }
+
+
+if __name__ == "__main__":
+    # construct the argument parser and parse the arguments
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-n", "--students", type=int, default=100000,
+                    help="number of decoy students to search through")
+    ap.add_argument("-q", "--queries", nargs="+",
+                    default=["j", "jo", "joh", "john", "john s", "2016", "comp", "computer science",
+                             "law 2019", "0042", "zzz"],
+                    help="queries to time, as typed into the search box")
+    args = vars(ap.parse_args())
+
+    print("[INFO] generating %d students..." % args["students"])
+    students = generateStudents(args["students"])
+
+    started = time.perf_counter()
+    index = SearchIndex(COURSES)
+    for student in students:
+        index.add(student)
+    print("[INFO] indexed %d students in %.2fs" %
+          (len(index), time.perf_counter() - started))
+
+    print("{:>18} {:>8} {:>10} {:>10}".format(
+        "query", "matches", "scan ms", "index ms"))
+    for text in args["queries"]:
+        query = set(filter(bool, text.lower().split(' ')))
+
+        started = time.perf_counter()
+        expected = scanMatches(students, query)
+        scanned = time.perf_counter() - started
+
+        started = time.perf_counter()
+        found = index.search(query)
+        searched = time.perf_counter() - started
+
+        assert found == expected, "index disagrees with scan on [%s]" % text
+        print("{:>18} {:>8} {:>10.1f} {:>10.1f}".format(
+            text, len(found), scanned * 1000, searched * 1000))
@@ -0,0 +1,100 @@
+import numpy as np
+import threading
+import hashlib
+import sqlite3
+import os
+
+
+class EmbeddingCache(object):
+    """
+    A persistent cache of the face box and embedding quantified from an
+    image, keyed by the SHA-1 of the image's content along with the
+    detector and embedder models and the confidence setting they were run
+    with. Images found to have no usable face are cached too, so they
+    aren't run through the networks again either.
+    """
+
+    def __init__(self, path, *, models, confidence):
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.exists(dirname):
+            print(
+                "[INFO] cache directory [%s] doesn't exist, attempting to create..." % dirname)
+            os.makedirs(dirname)
+
+        # fingerprint the models and settings every entry depends on
+        fingerprint = hashlib.sha1(("%r" % confidence).encode())
+        for model in models:
+            with open(model, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    fingerprint.update(block)
+        self.fingerprint = fingerprint.digest()
+
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(
+            path, timeout=30, check_same_thread=False)
+        self.__db.execute("PRAGMA journal_mode=WAL")
+        self.__db.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key BLOB PRIMARY KEY,
+                box BLOB,
+                vector BLOB
+            )
+        """)
+        self.__db.commit()
+
+    def key(self, content):
+        return hashlib.sha1(self.fingerprint + content).digest()
+
+    def get(self, key):
+        # returns whether `key` was found, along with its (box, vector)
+        with self.__lock:
+            row = self.__db.execute(
+                "SELECT box, vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return (False, None)
+        (box, vector) = row
+        if vector is None:
+            return (True, None)
+        return (True, (
+            tuple(np.frombuffer(box, dtype="<i4").tolist()),
+            np.frombuffer(vector, dtype="<f4").copy()))
+
+    def put(self, key, result):
+        (box, vector) = (None, None) if result is None else (
+            np.asarray(result[0], dtype="<i4").tobytes(),
+            np.asarray(result[1], dtype="<f4").tobytes())
+        with self.__lock:
+            self.__db.execute(
+                "INSERT OR REPLACE INTO embeddings (key, box, vector) VALUES (?, ?, ?)",
+                (key, box, vector))
+            self.__db.commit()
+
+    def quantifyMany(self, imagePaths, quantifier):
+        # the batched counterpart of quantify(), running
+        # `quantifier(contents)` once over every uncached image
+        contents = []
+        for imagePath in imagePaths:
+            with open(imagePath, "rb") as f:
+                contents.append(f.read())
+        keys = [self.key(content) for content in contents]
+        lookups = [self.get(key) for key in keys]
+        missing = [index for (index, (found, _)) in enumerate(lookups)
+                   if not found]
+        results = [result for (_, result) in lookups]
+        if missing:
+            for (index, result) in zip(missing, quantifier([contents[index] for index in missing])):
+                self.put(keys[index], result)
+                results[index] = result
+        return results
+
+    def quantify(self, imagePath, quantifier):
+        # look `imagePath` up by its content, falling back to running
+        # `quantifier(content)` on its raw content and caching the result
+        with open(imagePath, "rb") as f:
+            content = f.read()
+        key = self.key(content)
+        (found, result) = self.get(key)
+        if not found:
+            result = quantifier(content)
+            self.put(key, result)
+        return result
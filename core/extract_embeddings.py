@@ -1,19 +1,39 @@
 # USAGE
 # python extract_embeddings.py --dataset dataset --embeddings output/embeddings.pickle \
-#	--detector face_detection_model --embedding-model openface_nn4.small2.v1.t7
+#	--detector face_detection_model --embedding-model openface_nn4.small2.v1.t7 \
+#	[--workers 4] [--batch 16]
 
 # import the necessary packages
+from multiprocessing import Pool
+from embeddingcache import EmbeddingCache
 from imutils import paths
 import numpy as np
 import argparse
 import imutils
 import pickle
+import time
 import cv2
 import os
 
 
 class FaceDetector:
-    def __init__(self, *, detector, confidence, embedding_model):
+    def __init__(self, *, detector, confidence, embedding_model, cache=None, loadNetworks=True):
+        self.confidence = confidence
+        self.cache = None
+        # only collecting results quantified elsewhere (e.g. by worker
+        # processes) needs neither the networks nor the cache
+        if loadNetworks:
+            self.loadNetworks(detector, embedding_model, cache)
+
+        # initialize our lists of extracted facial embeddings and
+        # corresponding people names
+        self.knownEmbeddings = []
+        self.knownNames = []
+
+        # initialize the total number of faces processed
+        self.__totalFaces = 0
+
+    def loadNetworks(self, detector, embedding_model, cache=None):
         # load our serialized face detector from disk
         print("[INFO] loading face detector...")
         protoPath = os.path.sep.join([detector, "deploy.prototxt"])
@@ -25,43 +45,48 @@ class FaceDetector:
         print("[INFO] loading face recognizer...")
         self.embedder = cv2.dnn.readNetFromTorch(embedding_model)
 
-        self.confidence = confidence
+        # optionally look images up in a persistent embedding cache by
+        # their content before running them through the networks
+        self.cache = cache and EmbeddingCache(
+            cache, models=[protoPath, modelPath, embedding_model], confidence=self.confidence)
 
-        # initialize our lists of extracted facial embeddings and
-        # corresponding people names
-        self.knownEmbeddings = []
-        self.knownNames = []
+    def addImage(self, imagePath):
+        self.addResults([(imagePath, self.quantifyImage(imagePath))])
 
-        # initialize the total number of faces processed
-        self.__totalFaces = 0
+    def addImages(self, imagePaths):
+        self.addResults(zip(imagePaths, self.quantifyImages(imagePaths)))
 
-    def addImage(self, imagePath):
-        # extract the person name from the image path
-        name = imagePath.split(os.path.sep)[-2]
-
-        # load the image, resize it to have a width of 600 pixels (while
-        # maintaining the aspect ratio), and then grab the image
-        # dimensions
-        image = cv2.imread(imagePath)
-        image = imutils.resize(image, width=600)
-        (h, w) = image.shape[:2]
+    def addResults(self, results):
+        for (imagePath, result) in results:
+            if result is None:
+                continue
+            (_, vec) = result
 
-        # construct a blob from the image
-        imageBlob = cv2.dnn.blobFromImage(
-            cv2.resize(image, (300, 300)), 1.0, (300, 300),
-            (104.0, 177.0, 123.0), swapRB=False, crop=False)
+            # extract the person name from the image path
+            name = imagePath.split(os.path.sep)[-2]
 
-        # apply OpenCV's deep learning-based face detector to localize
-        # faces in the input image
-        self.detector.setInput(imageBlob)
-        detections = self.detector.forward()
+            # add the name of the person + corresponding face
+            # embedding to their respective lists
+            self.knownNames.append(name)
+            self.knownEmbeddings.append(vec)
+            self.__totalFaces += 1
+
+    def loadImage(self, content):
+        # decode the image, resize it to have a width of 600 pixels (while
+        # maintaining the aspect ratio)
+        image = cv2.imdecode(np.frombuffer(
+            content, dtype="uint8"), cv2.IMREAD_COLOR)
+        return imutils.resize(image, width=600)
+
+    def locateFace(self, image, detections):
+        (h, w) = image.shape[:2]
 
         # ensure at least one face was found
         if len(detections) > 0:
             # we're making the assumption that each image has only ONE
             # face, so find the bounding box with the largest probability
-            i = np.argmax(detections[0, 0, :, 2])
-            confidence = detections[0, 0, i, 2]
+            i = np.argmax(detections[:, 2])
+            confidence = detections[i, 2]
 
             # ensure that the detection with the largest probability also
             # means our minimum probability test (thus helping filter out
@@ -69,7 +94,7 @@ class FaceDetector:
             if confidence > self.confidence:
                 # compute the (x, y)-coordinates of the bounding box for
                 # the face
-                box = detections[0, 0, i, 3:7] * np.array([w, h, w, h])
+                box = detections[i, 3:7] * np.array([w, h, w, h])
                 (startX, startY, endX, endY) = box.astype("int")
 
                 # extract the face ROI and grab the ROI dimensions
@@ -78,21 +103,97 @@ class FaceDetector:
 
                 # ensure the face width and height are sufficiently large
                 if fW < 20 or fH < 20:
-                    return
-
-                # construct a blob for the face ROI, then pass the blob
-                # through our face embedding model to obtain the 128-d
-                # quantification of the face
-                faceBlob = cv2.dnn.blobFromImage(face, 1.0 / 255,
-                                                 (96, 96), (0, 0, 0), swapRB=True, crop=False)
-                self.embedder.setInput(faceBlob)
-                vec = self.embedder.forward()
-
-                # add the name of the person + corresponding face
-                # embedding to their respective lists
-                self.knownNames.append(name)
-                self.knownEmbeddings.append(vec.flatten())
-                self.__totalFaces += 1
+                    return None
+                return ((startX, startY, endX, endY), face)
+        return None
+
+    def quantifyImage(self, imagePath):
+        # returns the (box, vector) of the face in `imagePath`, if any
+        if self.cache:
+            return self.cache.quantify(imagePath, self.quantifyContent)
+        with open(imagePath, "rb") as f:
+            return self.quantifyContent(f.read())
+
+    def quantifyImages(self, imagePaths):
+        # the batched counterpart of quantifyImage()
+        if self.cache:
+            return self.cache.quantifyMany(imagePaths, self.quantifyContents)
+        contents = []
+        for imagePath in imagePaths:
+            with open(imagePath, "rb") as f:
+                contents.append(f.read())
+        return self.quantifyContents(contents)
+
+    def quantifyContent(self, content):
+        image = self.loadImage(content)
+
+        # construct a blob from the image
+        imageBlob = cv2.dnn.blobFromImage(
+            cv2.resize(image, (300, 300)), 1.0, (300, 300),
+            (104.0, 177.0, 123.0), swapRB=False, crop=False)
+
+        # apply OpenCV's deep learning-based face detector to localize
+        # faces in the input image
+        self.detector.setInput(imageBlob)
+        detections = self.detector.forward()
+
+        located = self.locateFace(image, detections[0, 0])
+        if located is None:
+            return None
+        (box, face) = located
+
+        # construct a blob for the face ROI, then pass the blob
+        # through our face embedding model to obtain the 128-d
+        # quantification of the face
+        faceBlob = cv2.dnn.blobFromImage(face, 1.0 / 255,
+                                         (96, 96), (0, 0, 0), swapRB=True, crop=False)
+        self.embedder.setInput(faceBlob)
+        return (box, self.embedder.forward().flatten())
+
+    def quantifyContents(self, contents):
+        # the batched counterpart of quantifyContent(), running the detector
+        # and then the embedder once over every image in `contents`
+        images = [self.loadImage(content) for content in contents]
+        if not images:
+            return []
+
+        imageBlob = cv2.dnn.blobFromImages(
+            [cv2.resize(image, (300, 300)) for image in images], 1.0, (300, 300),
+            (104.0, 177.0, 123.0), swapRB=False, crop=False)
+        self.detector.setInput(imageBlob)
+        detections = self.detector.forward()[0, 0]
+
+        # the first column of each detection is the index of its image
+        located = [self.locateFace(image, detections[detections[:, 0] == index])
+                   for (index, image) in enumerate(images)]
+        found = [index for (index, face) in enumerate(located)
+                 if face is not None]
+
+        results = [None] * len(images)
+        if found:
+            faceBlob = cv2.dnn.blobFromImages([located[index][1] for index in found], 1.0 / 255,
+                                              (96, 96), (0, 0, 0), swapRB=True, crop=False)
+            self.embedder.setInput(faceBlob)
+            for (index, vec) in zip(found, self.embedder.forward()):
+                results[index] = (located[index][0], vec.flatten())
+        return results
+
+    def verifyBatching(self, imagePaths):
+        # check that running `imagePaths` through the networks as a batch
+        # finds the same faces, with the same embeddings, as running them
+        # one at a time, bypassing the cache
+        contents = []
+        for imagePath in imagePaths:
+            with open(imagePath, "rb") as f:
+                contents.append(f.read())
+        batched = self.quantifyContents(contents)
+        for (imagePath, content, result) in zip(imagePaths, contents, batched):
+            expected = self.quantifyContent(content)
+            if (result is None) != (expected is None) or result is not None and not (
+                    np.allclose(result[0], expected[0], atol=1)
+                    and np.allclose(result[1], expected[1], atol=1e-5)):
+                raise RuntimeError(
+                    "batched embedding of [%s] differs from the serial one" % imagePath)
 
     def dump(self):
         return {"embeddings": self.knownEmbeddings, "names": self.knownNames}
@@ -101,6 +202,38 @@ class FaceDetector:
         return self.__totalFaces
 
 
+# the detector each worker process loads once, in initWorker(), and
+# whether it has checked its batched output against the serial path yet
+workerDetector = None
+workerVerified = False
+
+
+def initWorker(detector, embedding_model, confidence, cache):
+    global workerDetector
+    workerDetector = FaceDetector(
+        detector=detector,
+        embedding_model=embedding_model,
+        confidence=confidence,
+        cache=cache
+    )
+
+
+def quantifyChunk(args):
+    global workerVerified
+    (imagePaths, batched) = args
+    if batched and not workerVerified:
+        workerDetector.verifyBatching(imagePaths)
+        workerVerified = True
+    results = workerDetector.quantifyImages(imagePaths) if batched else \
+        [workerDetector.quantifyImage(imagePath) for imagePath in imagePaths]
+    return list(zip(imagePaths, results))
+
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
 if __name__ == "__main__":
     # construct the argument parser and parse the arguments
     ap = argparse.ArgumentParser()
@@ -114,23 +247,59 @@ if __name__ == "__main__":
                     help="path to OpenCV's deep learning face embedding model")
     ap.add_argument("-c", "--confidence", type=float, default=0.5,
                     help="minimum probability to filter weak detections")
+    ap.add_argument("-w", "--workers", type=int, default=0,
+                    help="number of worker processes to quantify images with (0 = serial)")
+    ap.add_argument("-b", "--batch", type=int, default=0,
+                    help="number of images to run through the networks at once (0 = unbatched)")
+    ap.add_argument("-k", "--cache", default="output/embedding_cache.sqlite",
+                    help="path to the persistent embedding cache (empty to disable)")
     args = vars(ap.parse_args())
 
+    # with worker processes, each loads the networks for itself while
+    # this one only collects their results
     faceDetector = FaceDetector(
         detector=args["detector"],
         embedding_model=args["embedding_model"],
-        confidence=args["confidence"]
+        confidence=args["confidence"],
+        cache=args["cache"],
+        loadNetworks=args["workers"] == 0
     )
 
     # grab the paths to the input images in our dataset
     print("[INFO] quantifying faces...")
     imagePaths = list(paths.list_images(args["dataset"]))
+    start = time.time()
+
+    batched = args["batch"] > 0
+    chunkSize = max(1, args["batch"])
+    if args["workers"] > 0:
+        # quantify chunks of images across worker processes, each with its
+        # own detector and embedder, collecting results in dataset order
+        with Pool(args["workers"], initializer=initWorker,
+                  initargs=(args["detector"], args["embedding_model"], args["confidence"], args["cache"])) as pool:
+            processed = 0
+            for results in pool.imap(quantifyChunk, ((chunk, batched) for chunk in chunked(imagePaths, chunkSize))):
+                processed += len(results)
+                print("[INFO] processed image {}/{}".format(processed,
+                                                            len(imagePaths)))
+                faceDetector.addResults(results)
+    else:
+        # loop over the image paths
+        processed = 0
+        if batched and imagePaths:
+            faceDetector.verifyBatching(imagePaths[:chunkSize])
+        for chunk in chunked(imagePaths, chunkSize):
+            processed += len(chunk)
+            print("[INFO] processing image {}/{}".format(processed,
+                                                         len(imagePaths)))
+            if batched:
+                faceDetector.addImages(chunk)
+            else:
+                faceDetector.addImage(chunk[0])
 
-    # loop over the image paths
-    for (i, imagePath) in enumerate(imagePaths):
-        print("[INFO] processing image {}/{}".format(i + 1,
-                                                     len(imagePaths)))
-        faceDetector.addImage(imagePath)
+    elapsed = time.time() - start
+    print("[INFO] quantified {} images in {:.2f}s ({:.2f} images/s)".format(
+        len(imagePaths), elapsed, len(imagePaths) / (elapsed or 1)))
 
     totalFaces = faceDetector.totalFaces()
 
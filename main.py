@@ -4,25 +4,30 @@ import yaml
 import sys
 import os
 from xrecogcore import XRecogCore
+from xrecogdb import Database, MatricIndex, AttendanceWriter
 from ui import QtWidgets, XrecogMainWindow
 from mysql import connector
 
 
 def getCoursesFromDatabase():
-    try:
-        cursor = connection.cursor(prepared=True)
-        cursor.execute("SELECT * FROM courses;")
-        return [name for (_, name) in cursor.fetchall()]
-    finally:
-        cursor.close()
+    return [name for (_, name) in database.query("SELECT * FROM courses;")]
 
 
-def getStudentsFromDatabase():
-    try:
-        connection.commit()
-        cursor = connection.cursor(prepared=True)
-        cursor.execute("SELECT * FROM attendees;")
-        return [
+def countStudentsInDatabase():
+    return database.query(
+        "SELECT COUNT(*) FROM attendees WHERE matricCode != %s;", ("0000",))[0][0]
+
+
+def streamStudentsFromDatabase(chunkSize):
+    # yield the students in batches of `chunkSize` as they're fetched,
+    # instead of reading the whole roster into memory up front
+    for rows in database.stream(
+            """
+            SELECT firstName, middleName, lastName, entryYear, matricCode, courseOfStudy, isPresent
+            FROM attendees WHERE matricCode != %s;
+            """, ("0000",), chunkSize):
+        matricIndex.update(matricCode for (_, _, _, _, matricCode, _, _) in rows)
+        yield [
             {
                 "firstName": firstName,
                 "middleName": middleName,
@@ -39,11 +44,8 @@ def getStudentsFromDatabase():
                 entryYear,
                 matriculationCode,
                 courseOfStudy,
-                markPresent) in cursor.fetchall()
-            if matriculationCode != "0000"
+                markPresent) in rows
         ]
-    finally:
-        cursor.close()
 
 
 def sqlErrorHandler(err):
@@ -59,23 +61,26 @@ def attendanceErrorHandler(err):
 
 
 def resetAttendance():
-    cursor = connection.cursor(prepared=True)
-    cursor.execute(
-        "UPDATE attendees SET isPresent = 0 WHERE isPresent = 1;")
-    connection.commit()
-    cursor.close()
+    attendanceWriter.reset()
     # hacky workaround, find a better way
-    main_window.loadStudents(getStudentsFromDatabase())
+    for students in streamStudentsFromDatabase(studentChunkSize()):
+        main_window.loadStudents(students)
 
 
 def verifyAsPresent(matricCode):
-    if matricCode != "0000":
+    # called for every recognized face on every frame, so leave the
+    # database write to the attendance writer, which drops repeat marks,
+    # while the UI is told every time in case a refresh reloaded the
+    # student as absent before their write landed
+    if matricCode == "0000":
+        return
+    attendanceWriter.mark(matricCode)
+    try:
         main_window.markStudent(matricCode)
-        cursor = connection.cursor(prepared=True)
-        cursor.execute(
-            f"UPDATE attendees SET isPresent = 1 WHERE matricCode LIKE \"{matricCode}\";")
-        connection.commit()
-        cursor.close()
+    except KeyError:
+        # not loaded into the UI yet (e.g. mid-refresh), a later frame
+        # marks them once they are
+        pass
 
 
 def registerStudent(student):
@@ -105,29 +110,28 @@ def registerStudent(student):
             shutil.move(imagePath, newPath)
             xrecogCore.addImage(student["matriculationCode"], newPath)
         logTick("Registering student, please wait...", 80)
-        cursor = connection.cursor(prepared=True)
-        cursor.execute(
-            f"""
+        database.execute(
+            """
             INSERT INTO attendees
             (firstName, middleName, lastName, entryYear, matricCode, courseOfStudy, isPresent)
             VALUES
+            (%s, %s, %s, %s, %s, %s, %s)
+            """,
             (
-                '{student["firstName"]}',
-                '{student["middleName"]}',
-                '{student["lastName"]}',
-                '{student["entryYear"]}',
-                '{student["matriculationCode"]}',
-                '{student["courseOfStudy"]}',
-                '{int(student["markPresent"])}'
+                student["firstName"],
+                student["middleName"],
+                student["lastName"],
+                student["entryYear"],
+                student["matriculationCode"],
+                student["courseOfStudy"],
+                int(student["markPresent"])
             )
-            """
         )
-        connection.commit()
-        cursor.close()
+        matricIndex.add(student["matriculationCode"])
         logTick("Analyzing student's face...", 90)
-        xrecogCore.quantifyFaces()
+        xrecogCore.quantifyFaces(student["matriculationCode"])
         logTick("Loading student into UI...", 97)
-        main_window.loadStudent(student).wait()
+        main_window.loadStudent(student).result()
         logTick("Finalizing student registration...", 99)
         main_window.resetButton.click()
 
@@ -140,20 +144,15 @@ def registerStudent(student):
     )
 
 
-def matricExistsInDb(matricCode, _cursor=None):
+def matricExistsInDb(matricCode):
     if matricCode == "0000":
         return True
-    cursor = _cursor or connection.cursor(prepared=True)
-    cursor.execute(f"""
+    return database.query("""
         SELECT EXISTS (
             SELECT 1 from attendees
-            WHERE matricCode = '{matricCode}'
+            WHERE matricCode = %s
         ) LIMIT 1
-    """)
-    ret = cursor.fetchone()[0] != 0
-    if _cursor == None:
-        cursor.close()
-    return ret
+    """, (matricCode,))[0][0] != 0
 
 
 def lookupMatric(matric):
@@ -212,17 +211,34 @@ def prepareBaseFacialVectors(addImage):
     return pQueue
 
 
+def studentChunkSize():
+    return int(CONFIG.setdefault("database", {}).setdefault("chunk_size", 1000))
+
+
 def loadStudentsIntoUI(timeout):
     def loadStudents(logTick):
         logTick("Loading serialized data...", 19)
         xrecogCore.loadPickles(prepareBaseFacialVectors)
         logTick("Loading students from database...", 40)
-        students = getStudentsFromDatabase()
-        nStudents = len(students)
-        for (index, job) in enumerate(main_window.loadStudents(students)):
+        nStudents = countStudentsInDatabase()
+        loaded = [0]
+
+        def settle(job, size):
+            job.result()
+            loaded[0] += size
             logTick(
-                f"Loading student into UI [%0{len(str(nStudents))}d/%d]..." % (index + 1, nStudents), tick=(60 / nStudents))
-            job.wait()
+                f"Loading students into UI [%0{len(str(nStudents))}d/%d]..." % (loaded[0], nStudents),
+                tick=(60 * size / max(nStudents, 1)))
+
+        # keep one batch loading into the UI while the next is fetched
+        pending = None
+        for students in streamStudentsFromDatabase(studentChunkSize()):
+            job = (main_window.loadStudents(students), len(students))
+            if pending:
+                settle(*pending)
+            pending = job
+        if pending:
+            settle(*pending)
         logTick("Finalizing student load...", 100)
 
     main_window._dispatch(
@@ -245,7 +261,7 @@ def mountMainInstance():
     main_window.setAboutText(
         "xRecog\n\nApp Description\n\n2020 (c) Femi Bankole, Miraculous Owonubi")
     main_window.matriculationCodeValidator = \
-        lambda matricCode: not matricExistsInDb(matricCode)
+        lambda matricCode: not matricIndex.exists(matricCode)
     main_window.on("refresh", lambda: loadStudentsIntoUI(timeout=1))
     main_window.on("tabChanged", tabChanged)
     main_window.on("resetAttendance", resetAttendance)
@@ -256,7 +272,7 @@ def mountMainInstance():
 
 if __name__ == "__main__":
     app = QtWidgets.QApplication(sys.argv)
-    global CONFIG, main_window, xrecogCore, connection
+    global CONFIG, main_window, xrecogCore, database, matricIndex, attendanceWriter
     if os.path.exists("config.yml"):
         with open("config.yml") as conf:
             CONFIG = yaml.safe_load(conf)
@@ -268,18 +284,39 @@ if __name__ == "__main__":
         print("[WARN] configuration file \"config.yml\" does not exist, using defaults")
         CONFIG = {}
 
-    main_window = XrecogMainWindow()
+    main_window = XrecogMainWindow(
+        workers=CONFIG.setdefault("prefs", {}).setdefault("workers", None))
     main_window.show()
+    tracking_opts = CONFIG.setdefault("model", {}).setdefault("tracking", {})
+    pipeline_opts = CONFIG.setdefault("model", {}).setdefault("pipeline", {})
+    recognizer_opts = CONFIG.setdefault(
+        "model", {}).setdefault("recognizer", {})
     xrecogCore = XRecogCore(
         detector="core/face_detection_model",
         embedding_model="core/openface_nn4.small2.v1.t7",
         confidence=float(CONFIG.setdefault(
             "model", {}).setdefault("confidence", 0.5)),
+        backend=str(recognizer_opts.setdefault("backend", "svc")),
+        similarityThreshold=float(
+            recognizer_opts.setdefault("similarity_threshold", 0.5)),
+        topK=int(recognizer_opts.setdefault("top_k", 5)),
+        detectInterval=int(tracking_opts.setdefault("detect_interval", 5)),
+        trackIoU=float(tracking_opts.setdefault("iou_threshold", 0.3)),
+        trackMaxAge=int(tracking_opts.setdefault("max_age", 2)),
+        identityTTL=float(tracking_opts.setdefault("identity_ttl", 30)),
+        confirmConfidence=float(
+            tracking_opts.setdefault("confirm_confidence", 0.8)),
+        pipelined=bool(pipeline_opts.setdefault("threaded", True)),
+        pipelineQueueSize=int(pipeline_opts.setdefault("queue_size", 2)),
+        embeddingCache=os.path.join(
+            CONFIG.setdefault("prefs", {})
+            .setdefault("pickle_path", "core/output"), "embedding_cache.sqlite")
+        if CONFIG.setdefault("model", {}).setdefault("embedding_cache", True) else None,
         prepareBaseFacialVectors=prepareBaseFacialVectors,
         pickleMaps={
-            "le": os.path.join(
+            "embeddings": os.path.join(
                 CONFIG.setdefault("prefs", {})
-                .setdefault("pickle_path", "core/output"), "le.pickle"),
+                .setdefault("pickle_path", "core/output"), "embeddings"),
             "pqueue": os.path.join(
                 CONFIG.setdefault("prefs", {})
                 .setdefault("pickle_path", "core/output"), "pqueue.pickle"),
@@ -289,23 +326,33 @@ if __name__ == "__main__":
         }
     )
     try:
-        print("[INFO] initializing MySQL Connection...")
+        print("[INFO] initializing MySQL Connection pool...")
         database_opts = CONFIG.setdefault("database", {})
         connection_opts = database_opts.setdefault("connection", {})
         auth_opts = database_opts.setdefault("auth", {})
-        connection = connector.connect(
-            host=str(connection_opts.setdefault("host", "localhost")),
-            port=int(connection_opts.setdefault("port", 3306)),
-            database=str(database_opts.setdefault("name", "xrecog")),
-            user=str(auth_opts.setdefault("user", "root")),
-            password=str(auth_opts.setdefault("pass", "")))
+        database = Database(
+            lambda: connector.connect(
+                host=str(connection_opts.setdefault("host", "localhost")),
+                port=int(connection_opts.setdefault("port", 3306)),
+                database=str(database_opts.setdefault("name", "xrecog")),
+                user=str(auth_opts.setdefault("user", "root")),
+                password=str(auth_opts.setdefault("pass", ""))),
+            size=int(connection_opts.setdefault("pool_size", 4)),
+            paramstyle=connector.paramstyle,
+            cursorOpts={"prepared": True})
+        matricIndex = MatricIndex(matricExistsInDb, ("0000",))
+        attendanceWriter = AttendanceWriter(
+            database,
+            interval=float(database_opts.setdefault("flush_interval", 0.25)),
+            errorHandler=sqlErrorHandler)
         mountMainInstance()
         app.exec_()
-        print("[INFO] closing MySQL Connection...")
-        if (connection.is_connected()):
-            connection.close()
-            print("[INFO] closed MySQL connection")
+        print("[INFO] writing pending attendance...")
+        attendanceWriter.close()
+        print("[INFO] closing MySQL Connections...")
+        database.close()
+        print("[INFO] closed MySQL connections")
         print("[INFO] dumping model state...")
-        xrecogCore.dump()
+        xrecogCore.consolidate()
     except connector.Error as err:
         sqlErrorHandler(err)
@@ -1,7 +1,7 @@
 import os
 import sys
+import cv2
 import time
-import queue
 import random
 import tempfile
 import functools
@@ -9,8 +9,8 @@ import itertools
 import markdown2
 import threading
 import traceback
+import numpy as np
 from datetime import datetime
-from collections import deque
 
 from PyQt5 import (
     uic,
@@ -23,7 +23,10 @@ from PyQt5 import (
 
 from . import resources_rc
 from .eventemitter import EventEmitter
-from .parallelizer import Parallelizer
+from .parallelizer import sharedPool
+from .recordindex import RecordIndex
+from .searchindex import SearchIndex
+from .studenttablemodel import StudentTableModel, StudentFilterProxyModel
 
 
 class XrecogImagePreviewDialog(QtWidgets.QDialog):
@@ -292,6 +295,11 @@ class XrecogCaptureWindow(QtWidgets.QDialog):
 
 
 class XrecogProgressDialog(QtWidgets.QDialog):
+    # repaint at most once per frame (~60Hz), however often it's ticked
+    TICK_INTERVAL = 16
+
+    tickSignal = QtCore.pyqtSignal()
+
     def __init__(self, title=None, max=None):
         super(XrecogProgressDialog, self).__init__()
         uic.loadUi(translatePath("progress_dialog.ui"), self)
@@ -302,6 +310,36 @@ class XrecogProgressDialog(QtWidgets.QDialog):
             self.progressBar.setValue(0)
         if title:
             self.setWindowTitle(title)
+        self.tickLock = threading.Lock()
+        self.pendingTick = None
+        self.tickTimer = QtCore.QTimer(self)
+        self.tickTimer.setSingleShot(True)
+        self.tickTimer.setInterval(self.TICK_INTERVAL)
+        self.tickTimer.timeout.connect(self._applyTick)
+        self.tickSignal.connect(self._scheduleTick)
+
+    def setTick(self, msg, progress):
+        # callable from any thread, only the latest tick is shown once the
+        # tick timer fires
+        with self.tickLock:
+            scheduled = self.pendingTick is not None
+            self.pendingTick = (msg, progress)
+        if not scheduled:
+            self.tickSignal.emit()
+
+    @QtCore.pyqtSlot()
+    def _scheduleTick(self):
+        if not self.tickTimer.isActive():
+            self.tickTimer.start()
+
+    @QtCore.pyqtSlot()
+    def _applyTick(self):
+        with self.tickLock:
+            (tick, self.pendingTick) = (self.pendingTick, None)
+        if tick:
+            (msg, progress) = tick
+            self.progressBar.setValue(int(progress))
+            self.label.setText(msg)
 
     def eventFilter(self, obj, event):
         if event.type() == QtCore.QEvent.KeyPress:
@@ -367,15 +405,27 @@ class XrecogPreviewWindow(QtWidgets.QDialog, EventEmitter):
 
 
 class XrecogCaptureDialog(QtWidgets.QDialog, EventEmitter):
-    setFrameImage = QtCore.pyqtSignal(QtGui.QPixmap, float)
+    setFrameImage = QtCore.pyqtSignal(QtGui.QImage, float)
     errorEmitter = QtCore.pyqtSignal(Exception)
 
+    # frame buffers cycled through by makeFrameImage(). The pixmap shown
+    # shares its frame's buffer, so at most FRAME_BUFFERS - 2 frames are
+    # let in flight to the UI thread, and the buffer written to is never
+    # one of those nor the one on display
+    FRAME_BUFFERS = 4
+
     def __init__(self):
         super(XrecogCaptureDialog, self).__init__()
         uic.loadUi(translatePath("capturedialog.ui"), self)
         self.endEvent = threading.Event()
         self.activeImage = None
-        self.videoSlot.resizeEvent = lambda event: self._setFrameImage()
+        self.displaySize = (self.videoSlot.width(), self.videoSlot.height())
+        self.frameBuffers = []
+        self.retiredFrameBuffers = []
+        self.frameIndex = 0
+        self.framesInFlight = 0
+        self.framesLock = threading.Lock()
+        self.videoSlot.resizeEvent = self._resizeVideoSlot
         self.setFrameImage.connect(self._setFrameImage)
         self.errorEmitter.connect(self._errorHandler)
         self.init()
@@ -407,42 +457,84 @@ class XrecogCaptureDialog(QtWidgets.QDialog, EventEmitter):
             QtWidgets.QMessageBox.Close)
         self.close()
 
+    def _resizeVideoSlot(self, event):
+        # frames are sized for the slot as they're made, the last one is
+        # only stretched over until the next comes in
+        self.displaySize = (event.size().width(), event.size().height())
+        self._setFrameImage()
+
     def _setFrameImage(self, image=None, fps=None):
-        image = image or self.activeImage
-        if image:
-            self.activeImage = image
-            self.videoSlot.setPixmap(
-                image.scaled(
+        if image is not None:
+            self.activeImage = QtGui.QPixmap.fromImage(image)
+            with self.framesLock:
+                self.framesInFlight -= 1
+        if self.activeImage:
+            pixmap = self.activeImage
+            if pixmap.width() > self.videoSlot.width() or pixmap.height() > self.videoSlot.height():
+                pixmap = pixmap.scaled(
                     self.videoSlot.size(),
                     QtCore.Qt.KeepAspectRatio,
-                    QtCore.Qt.SmoothTransformation,
-                ))
+                    QtCore.Qt.FastTransformation,
+                )
+            self.videoSlot.setPixmap(pixmap)
             if fps:
                 self.fpsFrame.setText("FPS:%7.2f" % fps)
             self.progressBar.hide()
 
-    def makeFrameImage(self, rgbImage):
-        h, w, ch = rgbImage.shape
-        bytesPerLine = ch * w
+    def makeFrameImage(self, frame):
+        # scale the BGR `frame` to fit the video slot straight into a
+        # reused BGRA buffer, which QImage and QPixmap take as is for
+        # RGB32, and hand that over without copying it
+        (h, w) = frame.shape[:2]
+        (slotW, slotH) = self.displaySize
+        scale = min(slotW / w, slotH / h)
+        size = (max(1, int(w * scale)), max(1, int(h * scale)))
+        with self.framesLock:
+            if self.framesInFlight >= self.FRAME_BUFFERS - 2:
+                # the UI is behind, drop the frame rather than queue it
+                return
+            if not self.frameBuffers or self.frameBuffers[0].shape[:2] != size[::-1]:
+                if self.framesInFlight:
+                    # don't free buffers the UI has yet to show
+                    return
+                # keep the buffers of the frame on display until the next
+                # one takes its place
+                self.retiredFrameBuffers = self.frameBuffers
+                self.frameBuffers = [np.empty((size[1], size[0], 4), np.uint8)
+                                     for _ in range(self.FRAME_BUFFERS)]
+            self.frameIndex = (self.frameIndex + 1) % self.FRAME_BUFFERS
+            buffer = self.frameBuffers[self.frameIndex]
+            self.framesInFlight += 1
+            # the rate frames are shown at, rather than how long one took,
+            # so frames dropped above don't count towards it
+            now = time.time()
+            fps = 1.0 / max(now - self._last_frame_time, 1e-6)
+            self._last_frame_time = now
+        cv2.cvtColor(
+            cv2.resize(frame, size, interpolation=cv2.INTER_LINEAR)
+            if size != (w, h) else frame,
+            cv2.COLOR_BGR2BGRA, dst=buffer)
         self.setFrameImage.emit(
-            QtGui.QPixmap.fromImage(
-                QtGui.QImage(
-                    rgbImage.data, w, h, bytesPerLine,
-                    QtGui.QImage.Format_RGB888)),
-            (1.0 / (time.time() - self._start_time))
-        )
+            QtGui.QImage(buffer.data, size[0], size[1],
+                         buffer.strides[0], QtGui.QImage.Format_RGB32),
+            fps)
 
     def installDisplayHandler(self, handler):
         try:
+            self._last_frame_time = time.time()
             while not self.endEvent.isSet():
-                self._start_time = time.time()
                 handler(self.makeFrameImage)
         except:
             self.errorEmitter.emit(sys.exc_info()[1])
 
 
 class XrecogMainWindow(QtWidgets.QMainWindow, EventEmitter):
-    def __init__(self):
+    # lanes of the shared work pool, lower priorities start first so that
+    # marking students present and searching don't queue up behind
+    # students being loaded in bulk
+    LANES = {"mark": 0, "search": 1, "load": 2}
+
+    def __init__(self, workers=None):
         super(XrecogMainWindow, self).__init__()
         uic.loadUi(translatePath("xrecog.ui"), self)
         self.query = set()
@@ -450,23 +542,35 @@ class XrecogMainWindow(QtWidgets.QMainWindow, EventEmitter):
         self.aboutText = None
         self.capture_window = None
         self.matriculationCodeValidator = None
+        self.closed = False
+        self.pool = sharedPool(workers)
+        self.lanes = {name: self.pool.lane(name, priority)
+                      for (name, priority) in self.LANES.items()}
+        self.recordLock = threading.Lock()
+        self.studentsLock = threading.Lock()
+        # loaded batches are tagged with the generation they were queued
+        # in, and skipped once a reset (or the window closing) moves past it
+        self.loaderGeneration = 0
         self.prepareAttendance()
         self.prepareRegistration()
         self.preparePrint()
         self.actionAbout.triggered.connect(self.showAbout)
         self.actionResetAttendance.triggered.connect(self.resetAttendance)
-        self.recordLock = threading.Lock()
-        self.studentsLock = threading.Lock()
-        self.presentTable.cellClicked.connect(lambda x, y: print(
-            self.students[self.matric_records["present"][x]]))
-        self.absentTable.cellClicked.connect(lambda x, y: print(
-            self.students[self.matric_records["absent"][x]]))
+        self.presentTable.clicked.connect(lambda index: print(
+            self.presentTable.model().student(index.row())))
+        self.absentTable.clicked.connect(lambda index: print(
+            self.absentTable.model().student(index.row())))
         self.attendanceCaptureDialog = XrecogCaptureDialog()
-        self.logTickSignal.connect(self._logTickHandler)
         self.errorEmitter.connect(self._errorHandler)
 
     def closeEvent(self, event):
+        self.closed = True
         self.emit("windowClose")
+        for (name, stats) in self.pool.stats().items():
+            self.log(
+                "<workPool> [%s] %d job(s), wait %.2fms mean, %.2fms p95, %.2fms max, run %.2fms mean" % (
+                    name, stats["completed"], stats["meanWait"], stats["p95Wait"],
+                    stats["maxWait"], stats["meanRun"]))
         return super(QtWidgets.QMainWindow, self).closeEvent(event)
 
     errorEmitter = QtCore.pyqtSignal(Exception)
@@ -492,42 +596,40 @@ class XrecogMainWindow(QtWidgets.QMainWindow, EventEmitter):
     def registerDispatcher(self, objectName):
         return lambda *args: self.emit(objectName, *args)
 
-    statUpdateSignal = QtCore.pyqtSignal()
+    # refresh the stats at most once per frame (~60Hz)
+    STATS_INTERVAL = 16
+
+    @QtCore.pyqtSlot()
+    def scheduleStats(self):
+        if not self.statsTimer.isActive():
+            self.statsTimer.start()
 
     @QtCore.pyqtSlot()
     def updateStats(self):
-        absentStudents = len(self.matric_records["absent"])
-        presentStudents = len(self.matric_records["present"])
+        stats = (len(self.matric_records["present"]),
+                 len(self.matric_records["absent"]))
+        if stats == self.shownStats:
+            return
+        self.shownStats = (presentStudents, absentStudents) = stats
         self.totalLineEdit.setText(
             "%d" % (presentStudents + absentStudents))
         self.presentLineEdit.setText("%d" % presentStudents)
         self.absentLineEdit.setText("%d" % absentStudents)
 
     def initStudentsLoader(self):
-        self.studentLoaderQueue = queue.Queue()
-        self.studentLoaderJobs = Parallelizer(
-            self.studentLoaderQueue.get, 2, self._addStudent)
-        self.studentLoaderJobs.start()
-
-        def clearStudentLoaderJobs():
-            self.studentLoaderJobs.pause()
-            [dq, self.studentLoaderQueue.queue] = [
-                self.studentLoaderQueue.queue, deque()]
-            self.studentLoaderJobs.resume()
-            dq.append(None)
-            for studentStack in iter(dq.popleft, None):
-                studentStack["event"].set()
-        self._clearStudentLoaderJobs = clearStudentLoaderJobs
-
         def cancelStudentLoaderJobs():
-            self.studentLoaderJobs.cancel()
-            clearStudentLoaderJobs()
-            self.studentLoaderQueue.put(None)
+            with self.studentsLock:
+                self.loaderGeneration += 1
         self.on("windowClose", cancelStudentLoaderJobs)
 
-    def _addStudent(self, studentStack):
+    def _addStudents(self, students, generation):
+        for student in students:
+            if not self._addStudent(student, generation):
+                return
+
+    def _addStudent(self, student, generation=None):
         student = {
-            **studentStack["student"],
+            **student,
             "isPresent": threading.Event(),
             "handleLock": threading.Lock(),
         }
@@ -536,73 +638,33 @@ class XrecogMainWindow(QtWidgets.QMainWindow, EventEmitter):
                 student["isPresent"].set()
             del student["markPresent"]
             with self.studentsLock:
+                if generation is not None and generation != self.loaderGeneration:
+                    return False
                 if student["matriculationCode"] in self.students:
-                    studentStack["event"].set()
-                    return
+                    return True
                 self.students[student["matriculationCode"]] = student
             self._pushRow(student)
-            studentStack["event"].set()
-
-    _addStudentRowSignal = QtCore.pyqtSignal(str, int, dict)
-    _rmStudentRowSignal = QtCore.pyqtSignal(str, int)
-
-    @QtCore.pyqtSlot(str, int, dict)
-    def _addStudentRow(self, key, index, student):
-        table = self.presentTable if key == "present" else self.absentTable
-        table.insertRow(index)
-        with self.logr("<_pushRow> Insert row slots"):
-            matricItem = QtWidgets.QTableWidgetItem()
-            firstNameItem = QtWidgets.QTableWidgetItem()
-            middleNameItem = QtWidgets.QTableWidgetItem()
-            lastNameItem = QtWidgets.QTableWidgetItem()
-            yearItem = QtWidgets.QTableWidgetItem()
-            courseItem = QtWidgets.QTableWidgetItem()
-            table.setItem(index, 0, matricItem)
-            table.setItem(index, 1, firstNameItem)
-            table.setItem(index, 2, middleNameItem)
-            table.setItem(index, 3, lastNameItem)
-            table.setItem(index, 4, yearItem)
-            table.setItem(index, 5, courseItem)
-        with self.logr("<_pushRow> Set row cell text"):
-            matricItem.setText(student["matriculationCode"])
-            firstNameItem.setText(student["firstName"])
-            middleNameItem.setText(student["middleName"])
-            lastNameItem.setText(student["lastName"])
-            yearItem.setText("%d" % student["entryYear"])
-            courseItem.setText(self.courses[student["courseOfStudy"]])
-
-    @QtCore.pyqtSlot(str, int)
-    def _rmStudentRow(self, key, index):
-        table = self.presentTable if key == "present" else self.absentTable
-        table.removeRow(index)
-
-    def initStudentsMarker(self):
-        self.studentMarkerQueue = queue.Queue()
-        self.studentMarkerJobs = Parallelizer(
-            self.studentMarkerQueue.get, 2, self._markStudent)
-        self.studentMarkerJobs.start()
-
-        def cancelStudentMarkerJobs():
-            self.studentMarkerJobs.cancel()
-            [dq, self.studentMarkerQueue.queue] = [
-                self.studentMarkerQueue.queue, deque()]
-            self.studentMarkerQueue.put(None)
-            dq.append(None)
-            for student in iter(dq.popleft, None):
-                student["isPresent"].set()
-        self.on("windowClose", cancelStudentMarkerJobs)
+        return True
+
+    def tableModel(self, key):
+        return self.presentModel if key == "present" else self.absentModel
 
     def _markStudent(self, student):
         matricCode = student["matriculationCode"]
         with student["handleLock"]:
             if student["isPresent"].isSet():
                 return
+            if self.closed:
+                # release anyone waiting on marks left over at close
+                student["isPresent"].set()
+                return
             with self.recordLock:
-                with self.logr("<markPresent> Matric lookup in records [%s]" % matricCode):
-                    index = self.matric_records["absent"].index(matricCode)
+                if self.students.get(matricCode) is not student:
+                    # attendance was reset since the mark was queued
+                    return
                 with self.logr("<markPresent> Matric remove from records [%s]" % matricCode):
-                    del self.matric_records["absent"][index]
-                self._rmStudentRowSignal.emit("absent", index)
+                    self.matric_records["absent"].remove(matricCode)
+                self.absentModel.removeStudent(matricCode)
             with self.logr(
                 "<markPresent> Push student into present table [%s]" % matricCode,
                 "<markPresent> Pushed student into present table [%s]" % matricCode,
@@ -615,70 +677,69 @@ class XrecogMainWindow(QtWidgets.QMainWindow, EventEmitter):
 
     def initQueryValidator(self):
         self.lookupLock = threading.Lock()
-        self.stop_lookup = threading.Event()
-        self.validatorQueue = queue.Queue()
-        self.validatorJobs = Parallelizer(
-            self.validatorQueue.get, 2, self._validateQuery)
-        self.validatorJobs.start()
-
-        def cancelValidatorJobs():
-            self.validatorJobs.cancel()
-            self.validatorQueue.queue.clear()
-            self.validatorQueue.put(None)
-        self.on("windowClose", cancelValidatorJobs)
-
-    def _validateQuery(self, student, doCancel):
-        searchFields = [student["firstName"], student["middleName"], student["lastName"],
-                        str(student["entryYear"]), student["matriculationCode"], self.courses[student["courseOfStudy"]]]
-
-        doHide = self.query and not all(any(
-            text in part
-            for value in searchFields
-            if not doCancel()
-            for part in filter(bool, value.lower().split(' '))
-            if not doCancel()
-        ) for text in self.query if not doCancel())
-        if not doCancel():
-            with student["handleLock"]:
-                if not doCancel():
-                    (table, record) = (self.presentTable, self.matric_records["present"]) \
-                        if student["isPresent"].isSet() \
-                        else (self.absentTable, self.matric_records["absent"])
-                    with self.recordLock:
-                        if not doCancel():
-                            index = record.index(student["matriculationCode"])
-                            if doHide:
-                                table.hideRow(index)
-                            elif table.isRowHidden(index):
-                                table.showRow(index)
+        self.queryLock = threading.Lock()
+        self.pendingQuery = None
+
+    def _submitQuery(self, query):
+        with self.queryLock:
+            self.pendingQuery = query
+        self.lanes["search"].submit(self._validateQuery)
+
+    def _validateQuery(self):
+        # every job applies the latest query typed rather than its own, so
+        # that however they're scheduled, the last one to run leaves the
+        # tables filtered by what's in the search box
+        with self.recordLock:
+            with self.queryLock:
+                (query, self.pendingQuery) = (self.pendingQuery, None)
+            if query is None or self.closed:
+                return
+            query = set(filter(bool, query.lower().split(' ')))
+            if not self.query.symmetric_difference(query):
+                return
+            with self.logr("Looking up query [%s]" % " ".join(query)):
+                matches = self.searchIndex.search(query) if query else None
+            (self.query, self.queryMatches) = (query, matches)
+            # each table refilters once against the new matches
+            self.presentModel.setFilter(matches)
+            self.absentModel.setFilter(matches)
 
     def _pushRow(self, student):
         self.log("<_pushRow> Creating student row on table")
 
         with self.recordLock:
+            matricCode = student["matriculationCode"]
+            if self.students.get(matricCode) is not student:
+                # attendance was reset since the student was added
+                return
             key = "present" \
                 if student["isPresent"].isSet() \
                 else "absent"
+            # index the student before its row lands, so that the filter
+            # of the current search already knows whether to show it
+            if matricCode not in self.searchIndex:
+                self.searchIndex.add(student)
+                if self.query and self.searchIndex.matches(matricCode, self.query):
+                    self.queryMatches.add(matricCode)
             with self.logr("<_pushRow> Append matric to record"):
-                record = self.matric_records[key]
-                index = len(record)
-                record.append(student["matriculationCode"])
-            self.statUpdateSignal.emit()
-            self._addStudentRowSignal.emit(key, index, student)
-            self.validatorQueue.put(student)
+                self.matric_records[key].append(matricCode)
+            self.tableModel(key).appendStudents([student])
 
     def _resetAttendance(self):
-        self.students = {}
-        self.matric_records = {"present": deque(), "absent": deque()}
-        if hasattr(self, "_clearStudentLoaderJobs"):
-            self._clearStudentLoaderJobs()
-        self.presentTable.clearContents()
-        self.absentTable.clearContents()
-        self.presentTable.setRowCount(0)
-        self.absentTable.setRowCount(0)
+        with self.recordLock, self.studentsLock:
+            self.students = {}
+            self.loaderGeneration += 1
+            self.searchIndex = SearchIndex(self.courses)
+            self.queryMatches = set() if self.query else None
+            self.matric_records = {"present": RecordIndex(), "absent": RecordIndex()}
+            self.presentModel.clear()
+            self.absentModel.clear()
+            self.presentModel.setFilter(self.queryMatches)
+            self.absentModel.setFilter(self.queryMatches)
         self.totalLineEdit.setText('0')
         self.presentLineEdit.setText('0')
         self.absentLineEdit.setText('0')
+        self.shownStats = (0, 0)
 
     def resetAttendance(self):
         self._resetAttendance()
@@ -689,17 +750,28 @@ class XrecogMainWindow(QtWidgets.QMainWindow, EventEmitter):
         self.emit("refresh")
 
     def prepareAttendance(self):
+        self.statsTimer = QtCore.QTimer(self)
+        self.statsTimer.setSingleShot(True)
+        self.statsTimer.setInterval(self.STATS_INTERVAL)
+        self.statsTimer.timeout.connect(self.updateStats)
+        for (key, table) in (("present", self.presentTable), ("absent", self.absentTable)):
+            model = StudentTableModel(self.courses, self)
+            proxy = StudentFilterProxyModel(self)
+            proxy.setSourceModel(model)
+            model.filterChanged.connect(proxy.setAcceptSet)
+            # recount the students once rows settle
+            model.rowsInserted.connect(self.scheduleStats)
+            model.dataChanged.connect(self.scheduleStats)
+            model.modelReset.connect(self.scheduleStats)
+            table.setModel(proxy)
+            setattr(self, "%sModel" % key, model)
         self._resetAttendance()
         self.initQueryValidator()
         self.initStudentsLoader()
-        self.initStudentsMarker()
         self.absentTable.setColumnWidth(0, 90)
         self.presentTable.setColumnWidth(0, 90)
         self.absentTable.setColumnWidth(4, 49)
         self.presentTable.setColumnWidth(4, 49)
-        self._addStudentRowSignal.connect(self._addStudentRow)
-        self._rmStudentRowSignal.connect(self._rmStudentRow)
-        self.statUpdateSignal.connect(self.updateStats)
         self.startCameraButton.clicked.connect(
             self.registerDispatcher("startCameraButtonClicked"))
         self.refreshToolButton.clicked.connect(self.refreshAttendance)
@@ -809,26 +881,9 @@ class XrecogMainWindow(QtWidgets.QMainWindow, EventEmitter):
         with self.lookupLock:
             if self.lookupTimer and not self.lookupTimer.finished.isSet():
                 self.lookupTimer.cancel()
-                self.stop_lookup.set()
                 self.lookupTimer.join()
-                self.stop_lookup.clear()
-
-            def doQueueLookups(query):
-                with self.logr("Looking up query [%s]" % query):
-                    query = set(filter(bool, query.lower().split(' ')))
-                    if self.query.symmetric_difference(query):
-                        self.query = query
-
-                        with self.recordLock:
-                            for matric in (
-                                    item for pair in itertools.zip_longest(
-                                        self.matric_records["present"],
-                                        self.matric_records["absent"]
-                                    ) for item in pair if item is not None):
-                                if self.stop_lookup.isSet():
-                                    break
-                                self.validatorQueue.put(self.students[matric])
-            self.lookupTimer = threading.Timer(1, doQueueLookups, (query,))
+            self.lookupTimer = threading.Timer(
+                1, self._submitQuery, (query,))
         self.lookupTimer.start()
 
     def loadCourses(self, courses):
@@ -838,36 +893,34 @@ class XrecogMainWindow(QtWidgets.QMainWindow, EventEmitter):
         self.courseComboBox.setCurrentIndex(-1)
 
     def loadStudents(self, students):
-        return [self.loadStudent(student) for student in students]
+        # queue `students` to be loaded as one batch, returning a future
+        # that's done once the whole batch is in
+        return self.lanes["load"].submit(
+            self._addStudents, list(students), self.loaderGeneration)
 
     def loadStudent(self, student):
-        addedEvent = threading.Event()
-        self.studentLoaderQueue.put({"student": student, "event": addedEvent})
-        return addedEvent
+        return self.loadStudents([student])
 
     def markStudents(self, matricCodes):
-        return [self.markStudent(matricCode) for matricCode in matricCodes]
+        # mark every student in `matricCodes` as present, returning a single
+        # future that's done once they all are
+        return self.lanes["mark"].batch(
+            self._markStudent, [self.students[matricCode] for matricCode in matricCodes])
 
     def markStudent(self, matricCode):
         student = self.students[matricCode]
-        self.studentMarkerQueue.put(student)
+        # students are marked again on every frame they're recognized in,
+        # so skip the mark lane for those already shown as present
+        if not student["isPresent"].isSet():
+            self.lanes["mark"].submit(self._markStudent, student)
         return student["isPresent"]
 
     def getAbsentStudentsMatric(self, n=None):
-        return [*self.matric_records["absent"]][:n]
-
-    logTickSignal = QtCore.pyqtSignal(
-        QtWidgets.QDialog, str, float, threading.Event)
-
-    def _logTickHandler(self, dialog, msg, progress, event):
-        dialog.progressBar.setValue(progress)
-        dialog.label.setText(msg)
-        event.set()
+        return [*itertools.islice(self.matric_records["absent"], n)]
 
     def _dispatch(self, executor, timeout=None, args=(), kwargs=None, *, title=None, message=None, max=None, tickValue=None, exceptionHandler=None):
-        (_progress, _events,
-         progressLock, finished) = ([-1], [],
-                                    threading.Lock(), threading.Event())
+        (_progress, progressLock, finished) = (
+            [-1], threading.Lock(), threading.Event())
         dialog = XrecogProgressDialog(title=title, max=max)
 
         def logTick(msg=None, progress=None, *, tick=False):
@@ -879,11 +932,7 @@ class XrecogMainWindow(QtWidgets.QMainWindow, EventEmitter):
                 elif tick and (tickValue if type(tick) == bool else isinstance(tick, (int, float))):
                     _progress[0] += (tick if isinstance(tick,
                                                         (int, float)) else tickValue)
-                event = threading.Event()
-                _events.append(event)
-                self.logTickSignal.emit(
-                    dialog,
-                    msg or message or "Loading...", _progress[0], event)
+                dialog.setTick(msg or message or "Loading...", _progress[0])
 
         def checkOrShowDialog():
             QtWidgets.QApplication.restoreOverrideCursor()
@@ -908,7 +957,6 @@ class XrecogMainWindow(QtWidgets.QMainWindow, EventEmitter):
                 else:
                     raise
             finally:
-                [job.wait() for job in _events]
                 finished.set()
                 dialog.close()
                 timer.cancel()
@@ -1,86 +1,120 @@
 import os
 import sys
+import time
 import random
-import threading
 from faker import Faker
 
 from . import (
     QtWidgets,
-    Parallelizer,
     XrecogMainWindow,
 )
+from .parallelizer import Parallelizer
+
+
+MIN_YEAR = 2014
+MAX_YEAR = 2023
+
+COURSES = [
+    "Computer Science",
+    "Physics",
+    "Chemistry",
+    "Law",
+    "Sociology",
+    "Political Sciences",
+    "Art",
+    "Philosophy",
+    "Music",
+    "Anthropology",
+    "Psychology",
+    "English",
+    "Astrophysics",
+    "Biology",
+    "Geography",
+    "Physiotheraphy",
+    "Medicine",
+    "French",
+    "Statistics",
+    "Biochemistry",
+    "Cybersecurity",
+    "Criminology",
+    "Economics",
+    "Epidemiology",
+    "Statistics",
+    "Mathematics"
+]
+
+
+fakers = {}
+
+
+def seedWorker():
+    # worker processes forked off the parent start out with a copy of its
+    # random state, and would otherwise all draw the same students
+    random.seed(os.getpid() ^ time.time_ns())
+
+
+def newStudent(matricCode):
+    # a module-level function, so that worker processes can run it, each
+    # with a Faker seeded afresh rather than a copy of its parent's
+    faker = fakers.get(os.getpid())
+    if faker is None:
+        faker = fakers[os.getpid()] = Faker()
+        faker.seed_instance()
+    male = bool(random.getrandbits(1))
+    return {
+        "firstName": faker.first_name_male() if male else faker.first_name_female(),
+        "middleName": faker.first_name_male() if male else faker.first_name_female(),
+        "lastName": faker.last_name_male() if male else faker.last_name_female(),
+        "entryYear": random.randint(MIN_YEAR, MAX_YEAR + 1),
+        "matriculationCode": matricCode,
+        "courseOfStudy": random.randint(0, len(COURSES) - 1),
+        "markPresent": False
+    }
+
+
+def generateStudents(num_students, *, jobs=None, processes=False, onStudent=None):
+    # generate `num_students` decoy students with distinct matric codes,
+    # calling `onStudent(index)` as each one comes in
+    max_students = max(10000, num_students)
+    students = []
+    pad = len(str(num_students))
+    matric_codes = [f"%0{pad}d" % matric_number for matric_number in random.sample(
+        range(0, max_students), num_students)]
+
+    def addStudent(student):
+        if onStudent:
+            onStudent(len(students))
+        students.append(student)
+    if processes:
+        jobs = jobs or os.cpu_count() or 1
+    else:
+        jobs = jobs or min(num_students, 100 if num_students >= 80000 else 8)
+    studentJobs = Parallelizer(
+        matric_codes, jobs, newStudent, processes=processes,
+        initializer=seedWorker if processes else None)
+    studentJobs.on("result", addStudent)
+    studentJobs.start()
+    studentJobs.joinAll()
+    return students
 
 
 def mountTestInstance(main_window):
-    MIN_YEAR = 2014
-    MAX_YEAR = 2023
-
     args = sys.argv[1:]
     num_students = int(args[0]) if len(args) else 10000
 
-    courses = [
-        "Computer Science",
-        "Physics",
-        "Chemistry",
-        "Law",
-        "Sociology",
-        "Political Sciences",
-        "Art",
-        "Philosophy",
-        "Music",
-        "Anthropology",
-        "Psychology",
-        "English",
-        "Astrophysics",
-        "Biology",
-        "Geography",
-        "Physiotheraphy",
-        "Medicine",
-        "French",
-        "Statistics",
-        "Biochemistry",
-        "Cybersecurity",
-        "Criminology",
-        "Economics",
-        "Epidemiology",
-        "Statistics",
-        "Mathematics"
-    ]
-
     with main_window.logr(
-            "Loading %d course%s" % (len(courses), "" if len(courses) == 1 else 's'), force=True):
-        main_window.loadCourses(courses)
+            "Loading %d course%s" % (len(COURSES), "" if len(COURSES) == 1 else 's'), force=True):
+        main_window.loadCourses(COURSES)
 
     def loadCoursesAndStudents(logTick):
         logTick("Preparing courses...", 1)
 
-        max_students = max(10000, num_students)
-
         logTick("Generating decoy students...")
         with main_window.logr("Generating %d student%s" % (num_students, "" if num_students == 1 else 's'), force=True):
-            faker = Faker()
-            students = []
-            pad = len(str(num_students))
-            matric_numbers = random.sample(
-                range(0, max_students), num_students)
-
-            def newStudent(matric_number):
-                logTick("Generating decoy students [%d/%d]..." % (
-                    len(students) + 1, num_students), tick=55 / num_students)
-                male = bool(random.getrandbits(1))
-                students.append({
-                    "firstName": faker.first_name_male() if male else faker.first_name_female(),
-                    "middleName": faker.first_name_male() if male else faker.first_name_female(),
-                    "lastName": faker.last_name_male() if male else faker.last_name_female(),
-                    "entryYear": random.randint(MIN_YEAR, MAX_YEAR + 1),
-                    "matriculationCode": f"%0{pad}d" % matric_number,
-                    "courseOfStudy": random.randint(0, len(courses) - 1),
-                    "markPresent": False
-                })
-            studentJobs = Parallelizer(matric_numbers, min(
-                num_students, 100 if num_students >= 80000 else 8), newStudent)
-            studentJobs.start()
-            studentJobs.joinAll()
+            students = generateStudents(
+                num_students,
+                onStudent=lambda index: logTick("Generating decoy students [%d/%d]..." % (
+                    index + 1, num_students), tick=55 / num_students))
 
         with main_window.logr(
             "Populating UI with %d student%s" % (
@@ -89,10 +123,16 @@ def mountTestInstance(main_window):
                 len(students), "" if len(students) == 1 else 's'),
             reenter=True, force=True
         ) as logr:
-            for (index, job) in enumerate(main_window.loadStudents(students)):
+            batchSize = 1000
+            jobs = [
+                (main_window.loadStudents(students[start:start + batchSize]),
+                 min(start + batchSize, num_students))
+                for start in range(0, num_students, batchSize)]
+            for (job, loaded) in jobs:
+                job.result()
                 logTick(
-                    f"Loading students into UI [%d/%d]..." % (index + 1, num_students), tick=(42 / num_students))
-                job.wait()
+                    f"Loading students into UI [%d/%d]..." % (loaded, num_students),
+                    tick=(42 * min(batchSize, num_students) / num_students))
 
         logTick("Finalizing demo instance setup...", 99)
 
@@ -117,7 +157,7 @@ def mountTestInstance(main_window):
         ))
         print("Entry Year: %d" % data["entryYear"])
         print("Matriculation Code: %s" % data["matriculationCode"])
-        print("Course of study: %s" % courses[data["courseOfStudy"]])
+        print("Course of study: %s" % COURSES[data["courseOfStudy"]])
         print("Mark as present: %s" % ("yes" if data["markPresent"] else "no"))
         print("Captured Images:")
         for image in data["capturedImages"]:
@@ -143,13 +183,8 @@ def mountTestInstance(main_window):
             "<startAttendanceCamera> Marked %s student%s" % (length, end),
             reenter=True, force=True, is_async=True
         ) as logr:
-            jobs = main_window.markStudents(foundStudents)
-
-            def handle():
-                for job in jobs:
-                    job.wait()
-                logr.done()
-        threading.Thread(target=handle).start()
+            job = main_window.markStudents(foundStudents)
+            job.add_done_callback(lambda _: logr.done())
 
     main_window.on("startCameraButtonClicked", startAttendanceCamera)
 
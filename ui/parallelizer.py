@@ -1,10 +1,37 @@
+import os
+import math
+import time
+import queue
+import itertools
 import threading
 from inspect import signature
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
 from ui.eventemitter import EventEmitter
 
 
+def _runChunk(fn, chunk):
+    return [fn(*args) for args in chunk]
+
+
 class Parallelizer(EventEmitter):
-    def __init__(self, items, jobs, handler, *, sentinel=None):
+    """
+    Runs `handler` over `items` on `jobs` threads, emitting "result" with
+    whatever it returns for each item. Each thread takes `chunksize` items
+    at a time off the shared iterator, so queues of many tiny items don't
+    contend on its lock for every one of them.
+
+    With `processes`, the threads instead ship chunks of items (64 unless
+    `chunksize` says otherwise) to as many worker processes, for CPU-bound
+    handlers the GIL would otherwise serialize, and emit the results as
+    each chunk comes back. The handler and items must then be picklable,
+    and pausing or cancelling takes effect between chunks. `initializer`
+    is called in each worker process as it starts, e.g. to reseed state
+    it would otherwise share with its parent.
+    """
+
+    def __init__(self, items, jobs, handler, *, sentinel=None, daemon=False, processes=False, chunksize=None,
+                 initializer=None):
         super().__init__()
         try:
             jobs = min(jobs, len(items))
@@ -19,41 +46,82 @@ class Parallelizer(EventEmitter):
         self.__doneLock = threading.Lock()
         self.__started = threading.Event()
         self.__finished = threading.Event()
+        self.__daemon = daemon
+        self.__chunksize = chunksize or (64 if processes else 1)
+        # plain flags, cheap enough to check between every item, with the
+        # per-thread events only waited on once they're raised
+        self.__paused = False
+        self.__cancelled = False
+        self.__processes = None
+        if processes:
+            if self.__takesChecker:
+                raise ValueError(
+                    "handlers taking a cancellation checker can't run in worker processes")
+            self.__processes = ProcessPoolExecutor(
+                max(jobs, 1), initializer=initializer)
         for job in range(jobs):
             self.__newThread(job)
 
+    def __nextChunk(self, notPausedEvent):
+        if self.__paused:
+            notPausedEvent.wait()
+        if self.__cancelled:
+            return []
+        with self.__itemsLock:
+            return list(itertools.islice(self.__items, self.__chunksize))
+
+    def __processHandler(self, notPausedEvent):
+        try:
+            while True:
+                chunk = self.__nextChunk(notPausedEvent)
+                if not chunk:
+                    break
+                for result in self.__processes.submit(
+                        _runChunk, self.__handler, [(item,) for item in chunk]).result():
+                    self.emit("result", result)
+        finally:
+            self.__tickThread()
+
     def __threadHandler(self, threadEvent, cancelledEvent, notPausedEvent):
-        def newConstraintChecker(listeners):
-            def checkConstraint(handle=None, persist=False):
-                if handle:
-                    with cancelledEvent._cond:
-                        if cancelledEvent.isSet():
-                            handle()
-                        else:
-                            if not persist:
-                                listeners.append(handle)
-                            threadEvent.on("cancel", handle)
-                else:
-                    return cancelledEvent.isSet()
-            return checkConstraint
+        if self.__processes:
+            return self.__processHandler(notPausedEvent)
 
+        # one checker per thread, with the cancel handles registered
+        # through it while handling an item dropped once it's done
+        listeners = []
+
+        def checkConstraint(handle=None, persist=False):
+            if handle:
+                with cancelledEvent._cond:
+                    if cancelledEvent.isSet():
+                        handle()
+                    else:
+                        if not persist:
+                            listeners.append(handle)
+                        threadEvent.on("cancel", handle)
+            else:
+                return self.__cancelled
+
+        (handler, emit) = (self.__handler, self.emit)
         try:
-            while not cancelledEvent.isSet():
-                notPausedEvent.wait()
-                listeners = []
-                try:
-                    try:
-                        with self.__itemsLock:
-                            item = next(self.__items)
-                    except StopIteration:
+            while True:
+                chunk = self.__nextChunk(notPausedEvent)
+                if not chunk:
+                    break
+                for item in chunk:
+                    if self.__paused:
+                        notPausedEvent.wait()
+                    if self.__cancelled:
                         break
-                    if self.__takesChecker:
-                        self.__handler(item, newConstraintChecker(listeners))
-                    else:
-                        self.__handler(item)
-                finally:
-                    for listener in listeners:
-                        threadEvent.removeListener("cancel", listener)
+                    if not self.__takesChecker:
+                        emit("result", handler(item))
+                        continue
+                    try:
+                        emit("result", handler(item, checkConstraint))
+                    finally:
+                        for listener in listeners:
+                            threadEvent.removeListener("cancel", listener)
+                        listeners.clear()
         finally:
             self.__tickThread()
 
@@ -65,6 +133,8 @@ class Parallelizer(EventEmitter):
                     (threadStack["thread"]._started.isSet()
                      and not threadStack["thread"].is_alive())
                     for threadStack in self.__threads if threadStack["thread"] != threading.current_thread()):
+                if self.__processes:
+                    self.__processes.shutdown()
                 self.__finished.set()
                 self.emit("finished")
 
@@ -79,7 +149,8 @@ class Parallelizer(EventEmitter):
         thread = threading.Thread(
             name="ParallelizerThread-%d" % index,
             target=self.__threadHandler,
-            args=(threadEvent, cancelledEvent, notPausedEvent))
+            args=(threadEvent, cancelledEvent, notPausedEvent),
+            daemon=self.__daemon)
         self.__threads.append(
             {
                 "thread": thread,
@@ -116,16 +187,19 @@ class Parallelizer(EventEmitter):
         return all(threadStack["cancelled"].isSet() for threadStack in self.__threads)
 
     def cancel(self):
+        self.__cancelled = True
         for threadStack in self.__threads:
             threadStack["threadEvent"].emit("cancel")
         self.emit("cancel")
 
     def pause(self):
+        self.__paused = True
         for threadStack in self.__threads:
             threadStack["threadEvent"].emit("pause")
         self.emit("pause")
 
     def resume(self):
+        self.__paused = False
         for threadStack in self.__threads:
             threadStack["threadEvent"].emit("resume")
         self.emit("resume")
@@ -138,9 +212,206 @@ class Parallelizer(EventEmitter):
             threadStack["thread"].join()
 
 
-if __name__ == "__main__":
-    import time
+class _ChunkedExecutor(Executor):
+    # map() and batch() on top of submit(), splitting the calls into
+    # chunks run as a job each
+
+    def _submitChunks(self, fn, argsList, chunksize):
+        argsList = list(argsList)
+        if not chunksize:
+            # a few chunks per worker, so they even out as they finish
+            chunksize = max(1, -(-len(argsList) // (4 * self.jobs)))
+        return [self.submit(_runChunk, fn, argsList[start:start + chunksize])
+                for start in range(0, len(argsList), chunksize)]
+
+    def map(self, fn, *iterables, timeout=None, chunksize=1):
+        # like Executor.map(), but with `chunksize` calls to `fn` per job
+        deadline = None if timeout is None else time.monotonic() + timeout
+        chunks = self._submitChunks(fn, zip(*iterables), chunksize)
+
+        def results():
+            for chunk in chunks:
+                yield from chunk.result(
+                    None if deadline is None else max(0, deadline - time.monotonic()))
+        return results()
+
+    def batch(self, fn, items, chunksize=None):
+        # call `fn` on each of `items`, returning a single future for the
+        # list of their results, failing with the first error raised
+        chunks = self._submitChunks(
+            fn, ((item,) for item in items), chunksize)
+        batch = Future()
+        batch.set_running_or_notify_cancel()
+        remaining = [len(chunks)]
+        lock = threading.Lock()
+
+        def settle(_):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            for chunk in chunks:
+                if chunk.cancelled() or chunk.exception():
+                    batch.set_exception(
+                        chunk.exception() if not chunk.cancelled()
+                        else RuntimeError("batch was cancelled"))
+                    return
+            batch.set_result([result for chunk in chunks for result in chunk.result()])
+        if not chunks:
+            batch.set_result([])
+        for chunk in chunks:
+            chunk.add_done_callback(settle)
+        return batch
+
+
+class WorkLane(_ChunkedExecutor):
+    """
+    A priority level of a WorkPool. Work submitted through a lane starts
+    ahead of any queued on lanes with a larger `priority`, and the lane
+    keeps track of how long its work waited for a worker and ran for.
+    """
+
+    # most recent waits kept to work out percentiles from
+    HISTORY = 1024
+
+    def __init__(self, pool, name, priority):
+        self.pool = pool
+        self.name = name
+        self.priority = priority
+        self.__statsLock = threading.Lock()
+        self.__completed = 0
+        self.__waited = 0.0
+        self.__ran = 0.0
+        self.__waits = deque(maxlen=self.HISTORY)
+
+    @property
+    def jobs(self):
+        return self.pool.jobs
 
+    def submit(self, fn, *args, **kwargs):
+        return self.pool._enqueue(self, fn, args, kwargs)
+
+    def record(self, waited, ran):
+        with self.__statsLock:
+            self.__completed += 1
+            self.__waited += waited
+            self.__ran += ran
+            self.__waits.append(waited)
+
+    def stats(self):
+        # milliseconds spent waiting for a worker and running, over all the
+        # lane's work, with percentiles over the most recent
+        with self.__statsLock:
+            (completed, waited, ran, waits) = (
+                self.__completed, self.__waited, self.__ran, sorted(self.__waits))
+        return {
+            "completed": completed,
+            "meanWait": 1000 * waited / max(completed, 1),
+            "p95Wait": 1000 * waits[int(.95 * (len(waits) - 1))] if waits else 0.0,
+            "maxWait": 1000 * waits[-1] if waits else 0.0,
+            "meanRun": 1000 * ran / max(completed, 1),
+        }
+
+
+class WorkPool(_ChunkedExecutor):
+    """
+    A fixed set of `jobs` daemon threads, run by a Parallelizer, that any
+    number of callers hand work to, getting back concurrent.futures
+    Futures instead of spinning up threads of their own and tracking an
+    Event per item. Work is queued on named lanes and started in order of
+    their priority, then in the order it was submitted; submit() itself
+    uses the "default" lane, at priority 0.
+    """
+
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self.__queue = queue.PriorityQueue()
+        self.__order = itertools.count()
+        self.__lanes = {}
+        self.__lanesLock = threading.Lock()
+        self.__default = self.lane("default", 0)
+        self.__shutdown = False
+        self.__shutdownLock = threading.Lock()
+        self.__workers = Parallelizer(
+            self.__take, jobs, self.__run, sentinel=None, daemon=True)
+        self.__workers.start()
+
+    def lane(self, name, priority=0):
+        # the lane called `name`, created at `priority` (lower goes first)
+        # by whichever caller asks for it first
+        with self.__lanesLock:
+            if name not in self.__lanes:
+                self.__lanes[name] = WorkLane(self, name, priority)
+            return self.__lanes[name]
+
+    def stats(self):
+        with self.__lanesLock:
+            lanes = list(self.__lanes.values())
+        return {lane.name: lane.stats() for lane in lanes}
+
+    def __take(self):
+        return self.__queue.get()[2]
+
+    def __run(self, work):
+        (future, fn, args, kwargs, lane, queued) = work
+        if not future.set_running_or_notify_cancel():
+            return
+        started = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as err:
+            lane.record(started - queued, time.perf_counter() - started)
+            future.set_exception(err)
+        else:
+            lane.record(started - queued, time.perf_counter() - started)
+            future.set_result(result)
+
+    def _enqueue(self, lane, fn, args, kwargs):
+        with self.__shutdownLock:
+            if self.__shutdown:
+                raise RuntimeError("cannot schedule new work after shutdown")
+            future = Future()
+            self.__queue.put((lane.priority, next(self.__order),
+                              (future, fn, args, kwargs, lane, time.perf_counter())))
+        return future
+
+    def submit(self, fn, *args, **kwargs):
+        return self.__default.submit(fn, *args, **kwargs)
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        with self.__shutdownLock:
+            if self.__shutdown:
+                return
+            self.__shutdown = True
+            if cancel_futures:
+                while True:
+                    try:
+                        self.__queue.get_nowait()[2][0].cancel()
+                    except queue.Empty:
+                        break
+            # queued behind every lane's work
+            self.__queue.put((math.inf, next(self.__order), None))
+        if wait:
+            self.__workers.joinAll()
+
+
+_sharedPool = None
+_sharedPoolLock = threading.Lock()
+
+
+def sharedPool(jobs=None):
+    # the WorkPool shared across the app, with `jobs` workers if it's the
+    # first call to ask for it, or as many as ThreadPoolExecutor would
+    # default to, since most of its work waits on locks or I/O
+    global _sharedPool
+    with _sharedPoolLock:
+        if _sharedPool is None:
+            _sharedPool = WorkPool(
+                jobs or min(32, (os.cpu_count() or 1) + 4))
+        return _sharedPool
+
+
+if __name__ == "__main__":
     def test1():
         def executor(item, doCancel):
             thread = threading.current_thread()
@@ -239,6 +510,38 @@ if __name__ == "__main__":
             par.cancel()
             par.joinAll()
 
+    def test5():
+        print("[\x1b[32mtest5\x1b[0m]: futures from a shared pool")
+        pool = WorkPool(4)
+        future = pool.submit(lambda a, b: a + b, 1, 2)
+        print(" * submit(1 + 2) = %a" % future.result())
+        squares = list(pool.map(lambda n: n * n, range(10000), chunksize=500))
+        print(" * map() squared %d items in chunks of 500" % len(squares))
+        assert squares == [n * n for n in range(10000)]
+        batch = pool.batch(lambda n: time.sleep(.01) or n, range(40))
+        print(" * batch() of 40 items, done = %a" % batch.done())
+        assert batch.result() == list(range(40))
+        print(" * batch() results in order once done")
+        pool.shutdown()
+
+    def test6():
+        print("[\x1b[32mtest6\x1b[0m]: work on higher priority lanes goes first")
+        pool = WorkPool(1)
+        (urgent, bulk) = (pool.lane("urgent", 0), pool.lane("bulk", 1))
+        (started, order) = (threading.Event(), [])
+        pool.submit(lambda: started.wait())
+        jobs = [bulk.submit(order.append, "bulk-%d" % n) for n in range(3)] + \
+            [urgent.submit(order.append, "urgent-%d" % n) for n in range(3)]
+        started.set()
+        for job in jobs:
+            job.result()
+        print(" * ran %s" % order)
+        assert order == ["urgent-0", "urgent-1", "urgent-2", "bulk-0", "bulk-1", "bulk-2"]
+        for (name, stats) in pool.stats().items():
+            print(" * [%s] %d done, %.2fms mean wait" %
+                  (name, stats["completed"], stats["meanWait"]))
+        pool.shutdown()
+
     print("Running test 1")
     test1()
     print()
@@ -250,3 +553,9 @@ if __name__ == "__main__":
     print()
     print("Running test 4")
     test4()
+    print()
+    print("Running test 5")
+    test5()
+    print()
+    print("Running test 6")
+    test6()
@@ -0,0 +1,134 @@
+class RecordIndex(object):
+    """
+    The matric codes of an attendance table in row order. Codes sit in
+    append-only slots, removed ones are left as tombstones, and a map of
+    code to slot along with a Fenwick tree counting the live slots before
+    each one answers membership in O(1) and a code's row, or the code at
+    a row, in O(log n). The slots are compacted once tombstones outnumber
+    the live codes.
+    """
+
+    def __init__(self, codes=()):
+        self.__slots = []
+        self.__tree = [0]
+        self.__positions = {}
+        for code in codes:
+            self.append(code)
+
+    def __len__(self):
+        return len(self.__positions)
+
+    def __contains__(self, code):
+        return code in self.__positions
+
+    def __iter__(self):
+        return (code for code in self.__slots if code is not None)
+
+    def __prefix(self, slot):
+        # the number of live codes in the first `slot` slots
+        total = 0
+        while slot > 0:
+            total += self.__tree[slot]
+            slot &= slot - 1
+        return total
+
+    def __add(self, slot, delta):
+        slot += 1
+        while slot < len(self.__tree):
+            self.__tree[slot] += delta
+            slot += slot & -slot
+
+    def append(self, code):
+        # add `code` as the last row, returning that row
+        if code in self.__positions:
+            raise KeyError("duplicate record [%s]" % code)
+        slot = len(self.__slots)
+        node = slot + 1
+        self.__slots.append(code)
+        self.__tree.append(
+            1 + self.__prefix(node - 1) - self.__prefix(node - (node & -node)))
+        self.__positions[code] = slot
+        return len(self.__positions) - 1
+
+    def row(self, code):
+        # the row `code` is displayed on, raises KeyError if it isn't here
+        return self.__prefix(self.__positions[code])
+
+    def __getitem__(self, row):
+        # the code displayed on `row`
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError("record row out of range")
+        (slot, remaining, step) = (0, row + 1, 1 << (len(self.__slots).bit_length()))
+        while step:
+            if slot + step < len(self.__tree) and self.__tree[slot + step] < remaining:
+                slot += step
+                remaining -= self.__tree[slot]
+            step >>= 1
+        return self.__slots[slot]
+
+    def remove(self, code):
+        # drop `code`, returning the row it was displayed on
+        slot = self.__positions.pop(code)
+        row = self.__prefix(slot)
+        self.__slots[slot] = None
+        self.__add(slot, -1)
+        if len(self.__slots) > 64 and len(self.__slots) > 2 * len(self.__positions):
+            self.__compact()
+        return row
+
+    def __compact(self):
+        codes = list(self)
+        (self.__slots, self.__tree, self.__positions) = ([], [0], {})
+        for code in codes:
+            self.append(code)
+
+
+if __name__ == "__main__":
+    from collections import deque
+    import random
+    import time
+
+    def test1():
+        print("[\x1b[32mtest1\x1b[0m]: rows follow appends and removals")
+        (records, reference) = (RecordIndex(), [])
+        for step in range(20000):
+            if reference and random.random() < 0.4:
+                code = random.choice(reference)
+                assert records.remove(code) == reference.index(code)
+                reference.remove(code)
+            else:
+                code = "%06d" % step
+                assert records.append(code) == len(reference)
+                reference.append(code)
+            if step % 997 == 0:
+                assert list(records) == reference
+                assert all(records[row] == code and records.row(code) == row
+                           for (row, code) in enumerate(reference))
+        print(" * %d records consistent" % len(records))
+
+    def test2():
+        print("[\x1b[32mtest2\x1b[0m]: marking 2000 of 20000 students present")
+        codes = ["%06d" % code for code in range(20000)]
+        marked = random.sample(codes, 2000)
+
+        started = time.perf_counter()
+        (absent, present) = (deque(codes), deque())
+        for code in marked:
+            del absent[absent.index(code)]
+            present.append(code)
+        print(" * deque:       %8.2fms" % ((time.perf_counter() - started) * 1000))
+
+        started = time.perf_counter()
+        (absent, present) = (RecordIndex(codes), RecordIndex())
+        for code in marked:
+            absent.remove(code)
+            present.append(code)
+        print(" * RecordIndex: %8.2fms" % ((time.perf_counter() - started) * 1000))
+
+    print("Running test 1")
+    test1()
+    print()
+    print("Running test 2")
+    test2()
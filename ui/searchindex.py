@@ -0,0 +1,88 @@
+class SearchIndex(object):
+    """
+    An inverted index from the lowercased words of each student's names,
+    entry year, matric code and course to their matric codes. A query
+    matches the students having, for every one of its words, some word
+    containing it; the vocabulary is scanned once per query word rather
+    than every student's fields, with the words found for recent query
+    words kept so that typing further only rescans those.
+
+    It isn't thread-safe, callers are expected to serialize access.
+    """
+
+    # most query words whose containing words are kept around
+    CACHE_SIZE = 64
+
+    def __init__(self, courses):
+        self.courses = courses
+        self.__postings = {}
+        self.__tokens = {}
+        self.__vocabulary = []
+        self.__cache = {}
+
+    def __len__(self):
+        return len(self.__tokens)
+
+    def __contains__(self, matricCode):
+        return matricCode in self.__tokens
+
+    def codes(self):
+        return self.__tokens.keys()
+
+    def tokenize(self, student):
+        return frozenset(
+            part
+            for value in (student["firstName"], student["middleName"], student["lastName"],
+                          str(student["entryYear"]), student["matriculationCode"],
+                          self.courses[student["courseOfStudy"]])
+            for part in value.lower().split(' ')
+            if part)
+
+    def add(self, student):
+        matricCode = student["matriculationCode"]
+        if matricCode in self.__tokens:
+            return
+        tokens = self.__tokens[matricCode] = self.tokenize(student)
+        for token in tokens:
+            if token not in self.__postings:
+                self.__postings[token] = set()
+                self.__vocabulary.append(token)
+                for (text, found) in self.__cache.items():
+                    if text in token:
+                        found.append(token)
+            self.__postings[token].add(matricCode)
+
+    def matches(self, matricCode, query):
+        tokens = self.__tokens[matricCode]
+        return all(any(text in token for token in tokens) for text in query)
+
+    def __containing(self, text):
+        # the words in the vocabulary containing `text`, narrowed down from
+        # those of the longest cached query word it contains
+        if text in self.__cache:
+            return self.__cache[text]
+        candidates = self.__vocabulary
+        for (cached, found) in self.__cache.items():
+            if cached in text and len(found) < len(candidates):
+                candidates = found
+        if len(self.__cache) >= self.CACHE_SIZE:
+            self.__cache.clear()
+        found = self.__cache[text] = [
+            token for token in candidates if text in token]
+        return found
+
+    def search(self, query):
+        # the matric codes of the students matching every word in `query`,
+        # starting from the longest (usually the most selective) word
+        result = None
+        for text in sorted(query, key=len, reverse=True):
+            if result is not None and len(result) < 1024:
+                # few enough students left to check their words directly
+                result = {matricCode for matricCode in result
+                          if any(text in token for token in self.__tokens[matricCode])}
+                continue
+            hits = set()
+            for token in self.__containing(text):
+                hits.update(self.__postings[token])
+            result = hits if result is None else result & hits
+        return set(self.__tokens) if result is None else result
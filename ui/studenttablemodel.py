@@ -0,0 +1,159 @@
+from array import array
+import threading
+from collections import deque
+from PyQt5 import QtCore
+
+
+class StudentTableModel(QtCore.QAbstractTableModel):
+    """
+    The rows of an attendance table, kept column by column in compact
+    arrays and formatted only as the view asks for them. Rows never move:
+    a removed student's row is left behind as a tombstone for the proxy
+    to hide, so removing one is O(1) however many rows follow it. Any
+    thread may post changes to it, they're applied in the order they were
+    posted on the model's own thread, with runs of insertions folded into
+    a single beginInsertRows() each.
+    """
+
+    FIELDS = ("matriculationCode", "firstName", "middleName",
+              "lastName", "entryYear", "courseOfStudy")
+
+    HEADERS = ("Matric Code", "First Name", "Middle Name",
+               "Last Name", "Year", "Course Of Study")
+
+    filterChanged = QtCore.pyqtSignal(object)
+    _pendingSignal = QtCore.pyqtSignal()
+
+    def __init__(self, courses, parent=None):
+        super(StudentTableModel, self).__init__(parent)
+        self.courses = courses
+        self.__reset()
+        self.__pending = deque()
+        self.__pendingLock = threading.Lock()
+        self.__scheduled = False
+        self._pendingSignal.connect(
+            self._applyPending, QtCore.Qt.QueuedConnection)
+
+    def __reset(self):
+        # the text columns hold references to the students' own strings,
+        # the numeric ones are packed
+        self.__columns = ([], [], [], [], array("i"), array("i"))
+        self.__live = bytearray()
+        self.__rowOf = {}
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.__live)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if role != QtCore.Qt.DisplayRole or not index.isValid():
+            return None
+        (row, column) = (index.row(), index.column())
+        value = self.__columns[column][row]
+        if column == 4:
+            return "%d" % value
+        elif column == 5:
+            return self.courses[value]
+        return value
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if role == QtCore.Qt.DisplayRole and orientation == QtCore.Qt.Horizontal:
+            return self.HEADERS[section]
+        return super(StudentTableModel, self).headerData(section, orientation, role)
+
+    def student(self, row):
+        return {field: column[row] for (field, column) in zip(self.FIELDS, self.__columns)}
+
+    def matricCode(self, row):
+        return self.__columns[0][row]
+
+    def isLive(self, row):
+        # whether `row` still holds a student, rather than a tombstone
+        return bool(self.__live[row])
+
+    def appendStudents(self, students):
+        self.__post("insert", list(students))
+
+    def removeStudent(self, matricCode):
+        self.__post("remove", matricCode)
+
+    def setFilter(self, matricCodes):
+        # have filterChanged carry `matricCodes` in order with the rows
+        # posted around it, None shows every student
+        self.__post("filter", matricCodes)
+
+    def clear(self):
+        self.__post("clear", None)
+
+    def __post(self, op, arg):
+        with self.__pendingLock:
+            if op == "insert" and self.__pending and self.__pending[-1][0] == "insert":
+                self.__pending[-1][1].extend(arg)
+            else:
+                self.__pending.append((op, arg))
+            if self.__scheduled:
+                return
+            self.__scheduled = True
+        self._pendingSignal.emit()
+
+    @QtCore.pyqtSlot()
+    def _applyPending(self):
+        with self.__pendingLock:
+            (pending, self.__pending) = (self.__pending, deque())
+            self.__scheduled = False
+        for (op, arg) in pending:
+            if op == "insert":
+                start = len(self.__live)
+                self.beginInsertRows(
+                    QtCore.QModelIndex(), start, start + len(arg) - 1)
+                for (field, column) in zip(self.FIELDS, self.__columns):
+                    column.extend(student[field] for student in arg)
+                self.__live.extend(b"\x01" * len(arg))
+                for (row, student) in enumerate(arg, start):
+                    self.__rowOf[student["matriculationCode"]] = row
+                self.endInsertRows()
+            elif op == "remove":
+                row = self.__rowOf.pop(arg, None)
+                if row is None:
+                    continue
+                # leave the row in place and let the proxy drop it, rather
+                # than shifting every row after it
+                self.__live[row] = 0
+                self.dataChanged.emit(
+                    self.index(row, 0), self.index(row, len(self.HEADERS) - 1))
+            elif op == "filter":
+                self.filterChanged.emit(arg)
+            else:
+                self.beginResetModel()
+                self.__reset()
+                self.endResetModel()
+
+
+class StudentFilterProxyModel(QtCore.QSortFilterProxyModel):
+    """
+    Shows only the live rows of a StudentTableModel whose matric code is
+    in the accept-set of the current search, refiltering once per search
+    instead of hiding and showing rows one by one.
+    """
+
+    def __init__(self, parent=None):
+        super(StudentFilterProxyModel, self).__init__(parent)
+        self.__accepted = None
+
+    @QtCore.pyqtSlot(object)
+    def setAcceptSet(self, matricCodes):
+        # rebuild the row mapping under a single layout change, which is
+        # far cheaper than invalidateFilter() signalling every run of rows
+        # shown or hidden separately
+        self.__accepted = matricCodes
+        self.invalidate()
+
+    def filterAcceptsRow(self, sourceRow, sourceParent):
+        model = self.sourceModel()
+        return model.isLive(sourceRow) and (
+            self.__accepted is None or model.matricCode(sourceRow) in self.__accepted)
+
+    def student(self, row):
+        return self.sourceModel().student(self.mapToSource(self.index(row, 0)).row())
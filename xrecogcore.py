@@ -4,10 +4,16 @@ from imutils.video import FPS
 from sklearn.svm import SVC
 import numpy as np
 import imutils
+import threading
 import pickle
+import copy
+import queue
+import time
 import cv2
 import os
-from itertools import zip_longest
+from itertools import count
+from xrecogstore import EmbeddingStore, atomicWrite
+from core.embeddingcache import EmbeddingCache
 
 
 def dumps(object, file):
@@ -16,8 +22,9 @@ def dumps(object, file):
         print(
             "[INFO] dump directory [%s] doesn't exist, attempting to create..." % dirname)
         os.mkdir(dirname)
-    with open(file, "wb") as f:
-        f.write(pickle.dumps(object))
+    # replace the file atomically, so an interrupted dump leaves the
+    # previous one intact
+    atomicWrite(file, lambda f: pickle.dump(object, f))
 
 
 def loads(file=None, constructor=None):
@@ -32,6 +39,245 @@ def loads(file=None, constructor=None):
     return object
 
 
+def boxIoU(boxesA, boxesB):
+    # compute the pairwise intersection-over-union of two sets of
+    # (startX, startY, endX, endY) boxes as a len(boxesA) x len(boxesB) matrix
+    boxesA = np.asarray(boxesA, dtype="float32")[:, None]
+    boxesB = np.asarray(boxesB, dtype="float32")[None, :]
+    iw = np.clip(np.minimum(boxesA[..., 2], boxesB[..., 2]) -
+                 np.maximum(boxesA[..., 0], boxesB[..., 0]), 0, None)
+    ih = np.clip(np.minimum(boxesA[..., 3], boxesB[..., 3]) -
+                 np.maximum(boxesA[..., 1], boxesB[..., 1]), 0, None)
+    intersection = iw * ih
+    areaA = (boxesA[..., 2] - boxesA[..., 0]) * (boxesA[..., 3] - boxesA[..., 1])
+    areaB = (boxesB[..., 2] - boxesB[..., 0]) * (boxesB[..., 3] - boxesB[..., 1])
+    return intersection / np.maximum(areaA + areaB - intersection, 1e-6)
+
+
+class FaceTracker(object):
+    """
+    Carries face boxes and their identities across frames by greedily
+    matching fresh detections to existing tracks on IoU. Between
+    detections, predict() moves each box along at the velocity of its
+    last two matched detections. Tracks that go unmatched for more than
+    `maxAge` detections are dropped.
+
+    Once a track's identity is confirmed, it's exempt from recognition for
+    `identityTTL` seconds, after which it gets re-verified.
+    """
+
+    def __init__(self, *, iouThreshold=0.3, maxAge=2, identityTTL=0):
+        self.iouThreshold = iouThreshold
+        self.maxAge = maxAge
+        self.identityTTL = identityTTL
+        self.tracks = []
+        self.__ids = count()
+        self.__frame = 0
+
+    def update(self, boxes):
+        self.__frame += 1
+        matches = {}
+        if self.tracks and boxes:
+            ious = boxIoU([track["box"] for track in self.tracks], boxes)
+            matchedTracks = set()
+            for flat in np.argsort(ious, axis=None)[::-1]:
+                (t, b) = np.unravel_index(flat, ious.shape)
+                if ious[t, b] < self.iouThreshold:
+                    break
+                if t in matchedTracks or b in matches:
+                    continue
+                matches[b] = t
+                matchedTracks.add(t)
+
+        seen = []
+        for (b, box) in enumerate(boxes):
+            if b in matches:
+                # the centroid's velocity in pixels per frame since the
+                # track was last detected
+                track = self.tracks[matches[b]]
+                track["velocity"] = (
+                    np.add(box[:2], box[2:]) - np.add(track["detected"][:2], track["detected"][2:])
+                ) / (2 * (self.__frame - track["detectedAt"]))
+            else:
+                track = {"id": next(self.__ids), "matricCode": None, "proba": 0.0,
+                         "confirmedAt": None, "velocity": np.zeros(2)}
+            track["box"] = track["detected"] = box
+            track["detectedAt"] = self.__frame
+            track["missed"] = 0
+            seen.append(track)
+
+        matchedTracks = set(matches.values())
+        lost = []
+        for (t, track) in enumerate(self.tracks):
+            if t not in matchedTracks:
+                track["missed"] += 1
+                if track["missed"] <= self.maxAge:
+                    lost.append(track)
+
+        self.tracks = seen + lost
+        return seen
+
+    def predict(self):
+        # extrapolate every track's box to the current frame from where
+        # it was last detected
+        self.__frame += 1
+        for track in self.tracks:
+            (dx, dy) = np.rint(
+                track["velocity"] * (self.__frame - track["detectedAt"])).astype("int").tolist()
+            (startX, startY, endX, endY) = track["detected"]
+            track["box"] = (startX + dx, startY + dy, endX + dx, endY + dy)
+
+    def confirmed(self, track, now):
+        return track["confirmedAt"] is not None \
+            and now - track["confirmedAt"] < self.identityTTL
+
+    def visible(self):
+        return [track for track in self.tracks if not track["missed"]]
+
+
+class SVCRecognizer(object):
+    """
+    A linear SVC with Platt-calibrated probabilities over the enrolled
+    embeddings, retrained from scratch on every fit().
+    """
+
+    # expensive to refit, so it's pickled alongside the embedding store
+    persistent = True
+    # its probabilities are held to the core's confidence when classified
+    thresholded = False
+
+    def __init__(self):
+        self.labelEncoder = LabelEncoder()
+        self.svc = SVC(C=1.0, kernel="linear", probability=True)
+        # how many embeddings of each label it was fit on, pickled along
+        # with it so a recognizer that fell behind the store can be told
+        self.fitCounts = {}
+
+    def fit(self, classes, labels, vectors):
+        # `labels` index each of the rows of `vectors` into `classes`
+        labelEncoder = LabelEncoder()
+        encoded = labelEncoder.fit_transform(classes)[labels]
+
+        svc = SVC(C=1.0, kernel="linear", probability=True)
+        svc.fit(vectors, encoded)
+
+        self.labelEncoder, self.svc = labelEncoder, svc
+        self.fitCounts = dict(zip(classes, np.bincount(
+            labels, minlength=len(classes)).tolist()))
+
+    def predict(self, vectors):
+        preds = self.svc.predict_proba(vectors)
+        j = np.argmax(preds, axis=1)
+        return (self.labelEncoder.classes_[j], preds[np.arange(len(j)), j])
+
+
+class CosineRecognizer(object):
+    """
+    A nearest-neighbour gallery of every enrolled embedding. Faces are
+    classified by the label with the highest summed cosine similarity
+    among their `topK` most similar gallery embeddings, and rejected if
+    their best similarity to that label falls below `threshold`.
+
+    The embeddings it's fit on are used as given, e.g. memory-mapped
+    straight from the embedding store, with the inverse of each one's
+    norm kept alongside rather than normalising them into a copy, while
+    those added since are kept L2-normalised in a contiguous float32
+    matrix of their own.
+    """
+
+    # cheap to rebuild, so it's refit from the embedding store on load
+    persistent = False
+    # rejects faces below `threshold` itself, labelling them None
+    thresholded = True
+
+    def __init__(self, *, threshold=0.5, topK=5):
+        self.threshold = threshold
+        self.topK = topK
+        self.classes = []
+        self.__classIndex = {}
+        self.base = np.empty((0, 128), dtype="float32")
+        self.baseScale = np.empty(0, dtype="float32")
+        self.baseLabels = np.empty(0, dtype="int32")
+        self.gallery = np.empty((0, 128), dtype="float32")
+        self.labels = np.empty(0, dtype="int32")
+        self.size = 0
+
+    @staticmethod
+    def normalize(vectors):
+        vectors = np.asarray(vectors, dtype="float32").reshape(-1, 128)
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    def fit(self, classes, labels, vectors):
+        # `labels` index each of the rows of `vectors` into `classes`
+        vectors = np.asarray(vectors, dtype="float32").reshape(-1, 128)
+        self.classes = list(classes)
+        self.__classIndex = {name: i for (i, name) in enumerate(self.classes)}
+        (self.base, self.baseLabels) = (vectors, np.asarray(labels, dtype="int32"))
+        # einsum reads the rows once without squaring them into a copy
+        self.baseScale = (1 / np.maximum(
+            np.sqrt(np.einsum("ij,ij->i", vectors, vectors)), 1e-12)).astype("float32")
+        self.gallery = np.empty((0, 128), dtype="float32")
+        self.labels = np.empty(0, dtype="int32")
+        self.size = 0
+
+    def add(self, name, vectors):
+        vectors = self.normalize(vectors)
+        if name not in self.__classIndex:
+            self.__classIndex[name] = len(self.classes)
+            self.classes.append(name)
+
+        # grow the gallery geometrically so appends are amortized O(1)
+        size = self.size + len(vectors)
+        if size > len(self.gallery):
+            capacity = max(size, 2 * len(self.gallery), 64)
+            gallery = np.empty((capacity, 128), dtype="float32")
+            labels = np.empty(capacity, dtype="int32")
+            gallery[:self.size] = self.gallery[:self.size]
+            labels[:self.size] = self.labels[:self.size]
+            self.gallery, self.labels = gallery, labels
+        self.gallery[self.size:size] = vectors
+        self.labels[self.size:size] = self.__classIndex[name]
+        self.size = size
+
+    def predict(self, vectors):
+        (base, baseScale, baseLabels) = (self.base, self.baseScale, self.baseLabels)
+        (gallery, labels, size) = (self.gallery, self.labels, self.size)
+        vectors = self.normalize(vectors)
+        if not len(base) + size:
+            return (np.full(len(vectors), None, dtype=object), np.zeros(len(vectors)))
+
+        # score every face against every enrolled embedding in one GEMM
+        # per matrix, then keep the `topK` most similar embeddings per face
+        sims = (vectors @ base.T) * baseScale
+        if size:
+            sims = np.hstack([sims, vectors @ gallery[:size].T])
+            baseLabels = np.concatenate([baseLabels, labels[:size]])
+        k = min(self.topK, sims.shape[1])
+        top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        topSims = np.take_along_axis(sims, top, axis=1)
+        topLabels = baseLabels[top]
+
+        # let the neighbours vote for their label by similarity, scoring
+        # each face by its best similarity to the winning label
+        votes = np.zeros((len(vectors), len(self.classes)), dtype="float32")
+        np.add.at(votes, (np.arange(len(vectors))[:, None], topLabels),
+                  np.clip(topSims, 0, None))
+        winners = np.argmax(votes, axis=1)
+        scores = np.where(topLabels == winners[:, None],
+                          topSims, -np.inf).max(axis=1)
+
+        accepted = scores >= self.threshold
+        names = np.full(len(vectors), None, dtype=object)
+        names[accepted] = [self.classes[label] for label in winners[accepted]]
+        return (names, np.where(accepted, scores, 0.0))
+
+
+RECOGNIZERS = {
+    "svc": SVCRecognizer,
+    "cosine": CosineRecognizer,
+}
+
+
 """
 xRecogCore = XRecogCore()
 xRecogCore.addStudent(<matricNumber>, images=[<image>,...])
@@ -41,11 +287,13 @@ xRecogCore.dump() -> {<matricNumber>: <vector>,...}
 
 
 class XRecogCore(object):
-    def __init__(self, *, detector, confidence, embedding_model, pickleMaps=None, prepareBaseFacialVectors):
+    def __init__(self, *, detector, confidence, embedding_model, pickleMaps=None, prepareBaseFacialVectors,
+                 backend="svc", similarityThreshold=0.5, topK=5,
+                 detectInterval=1, trackIoU=0.3, trackMaxAge=2, identityTTL=0, confirmConfidence=0.8,
+                 pipelined=False, pipelineQueueSize=2, embeddingCache=None):
         super().__init__()
         assert isinstance(pickleMaps, dict)
-        assert isinstance(pickleMaps["le"], str)
-        assert isinstance(pickleMaps["pqueue"], str)
+        assert isinstance(pickleMaps["embeddings"], str)
         assert isinstance(pickleMaps["recognizer"], str)
 
         # load our serialized face detector from disk
@@ -61,34 +309,110 @@ class XRecogCore(object):
 
         self.confidence = confidence
 
+        # optionally look enrollment images up in a persistent embedding
+        # cache by their content, so rebuilding the gallery from images
+        # that were quantified before skips the networks entirely
+        self.embeddingCache = embeddingCache and EmbeddingCache(
+            embeddingCache, models=[protoPath, modelPath, embedding_model], confidence=confidence)
+
+        # the recognizer backend used to classify face embeddings
+        assert backend in RECOGNIZERS, "unknown recognizer backend [%s]" % backend
+        self.backend = backend
+        self.backendOpts = {"threshold": similarityThreshold, "topK": topK} \
+            if backend == "cosine" else {}
+
+        # run the detector every `detectInterval` frames, tracking faces
+        # in between (an interval of 1 detects on every frame)
+        self.detectInterval = max(1, int(detectInterval))
+        self.trackIoU = trackIoU
+        self.trackMaxAge = trackMaxAge
+
+        # skip re-recognizing tracked faces recognized with at least
+        # `confirmConfidence` for `identityTTL` seconds (0 disables caching)
+        self.identityTTL = identityTTL
+        self.confirmConfidence = confirmConfidence
+
+        # run each live recognition stage on its own thread rather than
+        # all of them on a single one
+        self.pipelined = pipelined
+        self.pipelineQueueSize = max(1, int(pipelineQueueSize))
+
         self.pickleMaps = pickleMaps
 
+        # new enrollments are taken in by the recognizer immediately where
+        # it supports it, while refits and dumps are deferred to a
+        # background consolidation thread
+        self.__enrollLock = threading.RLock()
+        self.__consolidateLock = threading.Lock()
+        self.__pendingConsolidation = threading.Event()
+        self.__stale = self.__dirty = False
+
         self.loadPickles(prepareBaseFacialVectors)
 
+        threading.Thread(
+            name="XRecogCoreConsolidator", target=self.__consolidator, daemon=True).start()
+
+    def newRecognizer(self):
+        return RECOGNIZERS[self.backend](**self.backendOpts)
+
     def dump(self):
-        dumps(self.labelEncoder, self.pickleMaps["le"])
-        dumps(self.processQueue, self.pickleMaps["pqueue"])
-        dumps(self.svcRecognizer, self.pickleMaps["recognizer"])
+        # the embeddings are already journaled as they're enrolled, so only
+        # fold the journal into a new snapshot once it's grown large enough
+        self.store.compact()
+        if self.recognizer.persistent:
+            with self.__enrollLock:
+                recognizer = copy.copy(self.recognizer)
+            dumps(recognizer, self.pickleMaps["recognizer"])
 
     def loadPickles(self, prepareBaseFacialVectors):
-        self.labelEncoder = loads(
-            self.pickleMaps["le"], lambda: LabelEncoder())
-        self.processQueue = loads(
-            self.pickleMaps["pqueue"], lambda: prepareBaseFacialVectors(self._addImage))
-        (self.labelEncoder, self.svcRecognizer) = loads(
-            self.pickleMaps["vectors"],
-            lambda: (
-                LabelEncoder(),
-                SVC(C=1.0, kernel="linear", probability=True)
-            )
-        )
+        # persist any pending enrollments before reloading from disk
+        self.consolidate()
+        store = EmbeddingStore(self.pickleMaps["embeddings"])
+        if not len(store):
+            self.__seedStore(store, prepareBaseFacialVectors)
+        recognizer = loads(self.pickleMaps["recognizer"], self.newRecognizer) \
+            if RECOGNIZERS[self.backend].persistent else None
+        with self.__enrollLock:
+            (self.store, self.recognizer) = (store, recognizer)
+            self.__enrolled = store.counts()
+
+        if recognizer is None or not isinstance(recognizer, RECOGNIZERS[self.backend]):
+            if recognizer is not None:
+                # the configured backend changed since the recognizer was
+                # last dumped, so retrain one of the right kind
+                print("[INFO] switching recognizer backend to [%s]..." %
+                      self.backend)
+            self.recognizer = self.newRecognizer()
+            if len(self.store):
+                self.quantifyFaces()
+        elif getattr(recognizer, "fitCounts", None) != self.__enrolled:
+            # faces were journaled after the recognizer was last dumped
+            # (e.g. we exited before the consolidator caught up with them)
+            print("[INFO] refitting recognizer on enrolled faces...")
+            self.quantifyFaces()
+
+    def __seedStore(self, store, prepareBaseFacialVectors):
+        # carry over the embeddings of a pickled process queue from before
+        # the embedding store, otherwise start off with the base faces
+        pqueuePath = self.pickleMaps.get("pqueue")
+        if pqueuePath and os.path.exists(pqueuePath) and os.path.getsize(pqueuePath):
+            print("[INFO] migrating [%s] into the embedding store..." %
+                  pqueuePath)
+            with open(pqueuePath, "rb") as f:
+                processQueue = pickle.load(f)
+        else:
+            processQueue = prepareBaseFacialVectors(self._addImage)
+        for (matricCode, vectors) in processQueue.items():
+            if len(vectors):
+                store.append(matricCode, vectors)
+        store.compact(force=True)
 
     def addStudent(self, matricCode, images):
-        self._addStudent(matricCode, images, self.processQueue)
+        self._addStudent(matricCode, images, None)
 
     def addImage(self, matricCode, image):
         print("[INFO] processing image for [{}]".format(matricCode))
-        self._addImage(matricCode, image, self.processQueue)
+        self._addImage(matricCode, image, None)
 
     def _addStudent(self, matricCode, images, pQueue):
         for (index, imagePath) in enumerate(images):
@@ -97,10 +421,29 @@ class XRecogCore(object):
             self._addImage(matricCode, imagePath, pQueue)
 
     def _addImage(self, matricCode, imagePath, pQueue):
-        # load the image, resize it to have a width of 600 pixels (while
+        if self.embeddingCache:
+            result = self.embeddingCache.quantify(
+                imagePath, self.quantifyImage)
+        else:
+            with open(imagePath, "rb") as f:
+                result = self.quantifyImage(f.read())
+        if result is None:
+            return
+
+        # add the name of the person + corresponding face
+        # embedding to their respective lists
+        (_, vec) = result
+        self.addVectors(matricCode, [vec], pQueue)
+
+    def quantifyImage(self, content):
+        # returns the (box, vector) of the face in the encoded image
+        # `content`, or None if it holds no usable face
+        #
+        # decode the image, resize it to have a width of 600 pixels (while
         # maintaining the aspect ratio), and then grab the image
         # dimensions
-        image = cv2.imread(imagePath)
+        image = cv2.imdecode(np.frombuffer(
+            content, dtype="uint8"), cv2.IMREAD_COLOR)
         image = imutils.resize(image, width=600)
         (h, w) = image.shape[:2]
 
@@ -136,7 +479,7 @@ class XRecogCore(object):
 
                 # ensure the face width and height are sufficiently large
                 if fW < 20 or fH < 20:
-                    return
+                    return None
 
                 # construct a blob for the face ROI, then pass the blob
                 # through our face embedding model to obtain the 128-d
@@ -145,33 +488,168 @@ class XRecogCore(object):
                                                  (96, 96), (0, 0, 0), swapRB=True, crop=False)
                 self.embedder.setInput(faceBlob)
                 vec = self.embedder.forward()
+                return ((int(startX), int(startY), int(endX), int(endY)), vec.flatten())
+        return None
+
+    def addVectors(self, matricCode, vectors, pQueue=None):
+        # enroll into the embedding store unless given a process queue
+        if pQueue is None:
+            self.store.append(matricCode, vectors)
+        else:
+            pQueue \
+                .setdefault(matricCode, []) \
+                .extend(vectors)
+
+    def quantifyFaces(self, matricCode=None):
+        """
+        Brings the recognizer up to date with the enrolled faces.
+
+        Given a `matricCode`, only that student's newly added faces are
+        enrolled. Backends that support incremental enrollment take them in
+        immediately, others are refit by the background consolidation
+        thread, so the cost of a registration doesn't grow with the size
+        of the gallery. Without one, the recognizer is retrained on every
+        enrolled face and dumped, which can be potentially expensive.
+        """
+        if matricCode is None:
+            self.__retrain()
+            self.dump()
+            return
+
+        with self.__enrollLock:
+            count = self.store.count(matricCode)
+            newVectors = self.store.vectors(
+                matricCode, self.__enrolled.get(matricCode, 0), count)
+            self.__enrolled[matricCode] = count
+            if hasattr(self.recognizer, "add"):
+                if len(newVectors):
+                    self.recognizer.add(matricCode, newVectors)
+            else:
+                self.__stale = True
+            self.__dirty = True
+        self.__pendingConsolidation.set()
+
+    def __retrain(self):
+        with self.__enrollLock:
+            (classes, labels, matrix) = self.store.snapshot()
+            (names, vectors) = self.store.journal()
+            snapshot = self.store.counts()
+            self.__stale = False
+        recognizer = self.newRecognizer()
+        if hasattr(recognizer, "add"):
+            # fit on the memory-mapped snapshot as is, then add the few
+            # faces journaled since
+            if len(matrix):
+                recognizer.fit(classes, labels, matrix)
+            rows = {}
+            for (row, matricCode) in enumerate(names):
+                rows.setdefault(matricCode, []).append(row)
+            for (matricCode, matricRows) in rows.items():
+                recognizer.add(matricCode, vectors[matricRows])
+        elif len(matrix) or len(names):
+            # backends that can't add faces are fit on the snapshot and the
+            # journal together, copying them into one matrix
+            classIndex = {matricCode: i for (i, matricCode) in enumerate(classes)}
+            for matricCode in names:
+                classIndex.setdefault(matricCode, len(classIndex))
+            recognizer.fit(
+                list(classIndex),
+                np.concatenate([labels, np.array(
+                    [classIndex[matricCode] for matricCode in names], dtype="int32")]),
+                np.concatenate([matrix, vectors]) if len(names) else matrix)
+        with self.__enrollLock:
+            # catch the new recognizer up on faces that were enrolled
+            # incrementally while it was being fit
+            for (matricCode, enrolledCount) in self.__enrolled.items():
+                newVectors = self.store.vectors(
+                    matricCode, snapshot.get(matricCode, 0), enrolledCount)
+                if len(newVectors):
+                    if hasattr(recognizer, "add"):
+                        recognizer.add(matricCode, newVectors)
+                    else:
+                        self.__stale = True
+            for (matricCode, snapshotCount) in snapshot.items():
+                self.__enrolled[matricCode] = max(
+                    self.__enrolled.get(matricCode, 0), snapshotCount)
+            self.recognizer = recognizer
+
+    def __consolidator(self):
+        while True:
+            self.__pendingConsolidation.wait()
+            self.__pendingConsolidation.clear()
+            try:
+                self.consolidate()
+            except Exception as err:
+                print("[ERROR] failed to consolidate the recognizer:", err.__repr__())
+
+    def consolidate(self):
+        # refit the recognizer if it's behind the enrolled faces, then
+        # persist them, if anything changed since the last consolidation
+        with self.__consolidateLock:
+            with self.__enrollLock:
+                (stale, dirty) = (self.__stale, self.__dirty)
+                self.__dirty = False
+            if stale:
+                print("[INFO] refitting recognizer on enrolled faces...")
+                self.__retrain()
+            if dirty:
+                self.dump()
+
+    def detectFaces(self, frame):
+        (h, w) = frame.shape[:2]
 
-                # add the name of the person + corresponding face
-                # embedding to their respective lists
-                # TODO: LabelEncoder fit transform & recognizer fit embeddings
-                pQueue \
-                    .setdefault(matricCode, []) \
-                    .append(vec.flatten())
-
-    def quantifyFaces(self):
-        # performance untested! this can be potentially expensive
-        # it recreates both the labelencoder and svc recognizer
-        # try to limit calls to this method as much as possible
-        (names, vectors) = zip_longest(
-            *[
-                (name, vectors)
-                for name in self.processQueue
-                for vectors in self.processQueue[name]
-            ])
-        labelEncoder = LabelEncoder()
-        labels = labelEncoder.fit_transform(names)
-
-        svcRecognizer = SVC(C=1.0, kernel="linear", probability=True)
-        svcRecognizer.fit(vectors, labels)
+        # construct a blob from the image
+        imageBlob = cv2.dnn.blobFromImage(
+            cv2.resize(frame, (300, 300)), 1.0, (300, 300),
+            (104.0, 177.0, 123.0), swapRB=False, crop=False)
 
-        self.labelEncoder, self.svcRecognizer = labelEncoder, svcRecognizer
+        # apply OpenCV's deep learning-based face detector to localize
+        # faces in the input image
+        self.detector.setInput(imageBlob)
+        detections = self.detector.forward()
 
-        self.dump()
+        # filter out weak detections, then compute the (x, y)-coordinates
+        # of the bounding boxes for the remaining faces
+        confident = detections[0, 0, detections[0, 0, :, 2] > self.confidence]
+        boxes = confident[:, 3:7] * np.array([w, h, w, h])
+        return [tuple(box) for box in boxes.astype("int").tolist()]
+
+    def embedFaces(self, frame, boxes):
+        # extract the face ROIs, dropping those that aren't sufficiently
+        # large to be quantified, and keep the indices of those that are
+        faces, kept = [], []
+        for (index, (startX, startY, endX, endY)) in enumerate(boxes):
+            face = frame[startY:endY, startX:endX]
+            (fH, fW) = face.shape[:2]
+            if fW < 20 or fH < 20:
+                continue
+            faces.append(face)
+            kept.append(index)
+
+        if not faces:
+            return (kept, np.empty((0, 128), dtype="float32"))
+
+        # construct a single blob for all face ROIs, then pass the blob
+        # through our face embedding model in one forward pass to obtain
+        # the 128-d quantification of every face
+        faceBlob = cv2.dnn.blobFromImages(faces, 1.0 / 255,
+                                          (96, 96), (0, 0, 0), swapRB=True, crop=False)
+        self.embedder.setInput(faceBlob)
+        return (kept, self.embedder.forward())
+
+    def classifyFaces(self, vectors):
+        if not len(vectors):
+            return ([], [])
+
+        # perform classification to recognize all faces in one call
+        return self.recognizer.predict(vectors)
+
+    def recognizeFaces(self, frame, boxes):
+        # yields (index into boxes, matricCode, probability) for every
+        # face that was large enough to be recognized
+        (kept, vectors) = self.embedFaces(frame, boxes)
+        (matricCodes, probas) = self.classifyFaces(vectors)
+        return zip(kept, matricCodes, probas)
 
     def initRecognizer(self, *, lookupLabel, markAsPresent, imageDisplayHandler=None, cameraDevice=0):
         assert callable(lookupLabel)
@@ -182,94 +660,309 @@ class XRecogCore(object):
         print("[INFO] starting video stream...")
         vs = VideoStream(src=cameraDevice).start()
 
-        # start the FPS throughput estimator
-        fps = FPS().start()
-
-        def readFrameAndDisplay(setFrameImage):
-            # grab the frame from the threaded video stream
-            frame = vs.read()
-            if frame is None:
-                return
-
-            # resize the frame to have a width of 600 pixels (while
-            # maintaining the aspect ratio), and then grab the image
-            # dimensions
-            frame = imutils.resize(frame, width=600)
-            (h, w) = frame.shape[:2]
-
-            # construct a blob from the image
-            imageBlob = cv2.dnn.blobFromImage(
-                cv2.resize(frame, (300, 300)), 1.0, (300, 300),
-                (104.0, 177.0, 123.0), swapRB=False, crop=False)
-
-            # apply OpenCV's deep learning-based face detector to localize
-            # faces in the input image
-            self.detector.setInput(imageBlob)
-            detections = self.detector.forward()
-
-            # loop over the detections
-            for i in range(0, detections.shape[2]):
-                # extract the confidence (i.e., probability) associated with
-                # the prediction
-                confidence = detections[0, 0, i, 2]
-
-                # filter out weak detections
-                if confidence > self.confidence:
-                    # compute the (x, y)-coordinates of the bounding box for
-                    # the face
-                    box = detections[0, 0, i, 3:7] * np.array([w, h, w, h])
-                    (startX, startY, endX, endY) = box.astype("int")
-                    cv2.rectangle(frame, (startX, startY), (endX, endY),
-                                  (194, 188, 200), 2)
-
-                    # extract the face ROI
-                    face = frame[startY:endY, startX:endX]
-                    (fH, fW) = face.shape[:2]
-
-                    # ensure the face width and height are sufficiently large
-                    if fW < 20 or fH < 20:
-                        continue
-
-                    # construct a blob for the face ROI, then pass the blob
-                    # through our face embedding model to obtain the 128-d
-                    # quantification of the face
-                    faceBlob = cv2.dnn.blobFromImage(face, 1.0 / 255,
-                                                     (96, 96), (0, 0, 0), swapRB=True, crop=False)
-                    self.embedder.setInput(faceBlob)
-                    vec = self.embedder.forward()
-
-                    # perform classification to recognize the face
-                    preds = self.svcRecognizer.predict_proba(vec)[0]
-                    j = np.argmax(preds)
-                    proba = preds[j]
-                    matricCode = self.labelEncoder.classes_[j]
-                    name = lookupLabel(matricCode)
-                    if proba < self.confidence:
-                        continue
-                    if name:
-                        # draw the bounding box of the face along with the
-                        # associated probability
-                        text = "{}: {:.2f}%".format(name, proba * 100)
-                        y = startY - 10 if startY - 10 > 10 else startY + 10
-                        cv2.putText(frame, text, (startX, y),
-                                    cv2.FONT_HERSHEY_COMPLEX, 0.55, (0, 0, 256), 2)
-
-                        print("DETECTED [%s] (confidence=%.2f%%)" %
-                              (name, proba * 100))
+        pipeline = RecognitionPipeline(
+            self, videoStream=vs, lookupLabel=lookupLabel, markAsPresent=markAsPresent,
+            queueSize=self.pipelineQueueSize)
 
-                    markAsPresent(matricCode)
+        # recognize faces in the background as fast as they can be, while
+        # the display handler is shown every camera frame as it comes in,
+        # annotated with whatever was last recognized
+        pipeline.start(threaded=self.pipelined)
 
-            # update the FPS counter
-            fps.update()
-
-            # show the output frame
-            setFrameImage(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        def readFrameAndDisplay(setFrameImage):
+            image = pipeline.preview(timeout=0.1)
+            if image is not None:
+                setFrameImage(image)
 
         # loop over frames from the video file stream
-        imageDisplayHandler(readFrameAndDisplay)
-
-        # stop the timer and display FPS information
-        fps.stop()
-        print("[INFO] elasped time: {:.2f}".format(fps.elapsed()))
-        print("[INFO] approx. FPS: {:.2f}".format(fps.fps()))
+        try:
+            imageDisplayHandler(readFrameAndDisplay)
+        finally:
+            pipeline.stop()
+
+        # display FPS and per-stage information
+        print("[INFO] elasped time: {:.2f}".format(pipeline.fps.elapsed()))
+        print("[INFO] approx. FPS: {:.2f}".format(pipeline.fps.fps()))
+        print("[INFO] approx. recognition FPS: {:.2f}".format(
+            pipeline.recognitionFps.fps()))
+        for (stage, stats) in pipeline.stats().items():
+            print("[INFO] stage [{}]: {} frames, {:.2f}ms avg, queue {:.2f} avg/{} max of {}, {} dropped".format(
+                stage, stats["processed"], stats["latency"] * 1000,
+                stats["depth"], stats["maxDepth"], self.pipelineQueueSize, stats["dropped"]))
         vs.stop()
+
+
+class StageQueue(queue.Queue):
+    """
+    A bounded queue that never blocks its producer, instead dropping the
+    oldest queued item to make room for a new one. Its depth is sampled
+    on every put(), as it's only meaningful while items flow through it.
+    """
+
+    def __init__(self, maxsize):
+        super().__init__(maxsize)
+        self.dropped = 0
+        self.puts = 0
+        self.totalDepth = 0
+        self.maxDepth = 0
+
+    def put(self, item):
+        with self.mutex:
+            if 0 < self.maxsize <= self._qsize():
+                self._get()
+                self.dropped += 1
+            else:
+                self.unfinished_tasks += 1
+            self._put(item)
+            depth = self._qsize()
+            self.puts += 1
+            self.totalDepth += depth
+            self.maxDepth = max(self.maxDepth, depth)
+            self.not_empty.notify()
+
+
+class RecognitionPipeline(object):
+    """
+    Live recognition split into capture -> detect -> embed -> classify
+    stages, with a render stage drawing their latest results over the
+    preview. Once start()ed, the recognition stages run in the background
+    on the latest camera frame, either stepped through one after the
+    other on a single thread, or each on its own thread connected by
+    bounded drop-oldest queues so that the detector for the next frame
+    runs while the current one is embedded and classified. Meanwhile
+    preview() renders every camera frame as it comes in, so the preview
+    runs at the camera's rate however long recognition takes.
+    """
+
+    RECOGNITION_STAGES = ("capture", "detect", "embed", "classify")
+    STAGES = RECOGNITION_STAGES + ("render",)
+
+    def __init__(self, core, *, videoStream, lookupLabel, markAsPresent, queueSize=2):
+        self.core = core
+        self.vs = videoStream
+        self.lookupLabel = lookupLabel
+        self.markAsPresent = markAsPresent
+
+        # track faces between detections so the detector and embedder
+        # only run every `detectInterval` frames
+        self.tracker = FaceTracker(
+            iouThreshold=core.trackIoU, maxAge=core.trackMaxAge, identityTTL=core.identityTTL)
+        self.trackerLock = threading.Lock()
+        self.frameIndex = count()
+
+        # start the FPS throughput estimators of the preview and of the
+        # recognition stages
+        self.fps = FPS().start()
+        self.recognitionFps = FPS().start()
+
+        # the queue feeding each recognition stage after capture
+        self.queues = {stage: StageQueue(queueSize)
+                       for stage in self.RECOGNITION_STAGES[1:]}
+        self.__stats = {stage: {"processed": 0, "elapsed": 0.0}
+                        for stage in self.STAGES}
+        self.__threads = []
+        self.__stopped = threading.Event()
+        self.__error = None
+        self.__lastFrame = None
+        self.__shownFrame = None
+        # the tracked faces as of the last classified frame
+        self.__visible = []
+
+    def capture(self, frame=None):
+        # grab the frame from the threaded video stream
+        frame = self.vs.read() if frame is None else frame
+        if frame is None:
+            return None
+
+        # resize the frame to have a width of 600 pixels (while
+        # maintaining the aspect ratio)
+        return {"frame": imutils.resize(frame, width=600), "pending": []}
+
+    def detect(self, packet):
+        # localize faces on detection frames, or whenever we've lost track
+        # of every face; in between, the tracked identities carry over from
+        # the last detection while their boxes are moved along
+        with self.trackerLock:
+            doDetect = next(self.frameIndex) % self.core.detectInterval == 0 \
+                or not self.tracker.tracks
+            if not doDetect:
+                self.tracker.predict()
+        if doDetect:
+            boxes = self.core.detectFaces(packet["frame"])
+            now = time.monotonic()
+            with self.trackerLock:
+                packet["now"] = now
+                packet["pending"] = [track for track in self.tracker.update(boxes)
+                                     if not self.tracker.confirmed(track, now)]
+        return packet
+
+    def embed(self, packet):
+        # quantify all sufficiently large faces whose identity isn't
+        # already confirmed in a single batch
+        (packet["kept"], packet["vectors"]) = self.core.embedFaces(
+            packet["frame"], [track["box"] for track in packet["pending"]])
+        return packet
+
+    def classify(self, packet):
+        (matricCodes, probas) = self.core.classifyFaces(packet["vectors"])
+        recognized = []
+        with self.trackerLock:
+            for (index, matricCode, proba) in zip(packet["kept"], matricCodes, probas):
+                track = packet["pending"][index]
+                if matricCode is None or (
+                        not self.core.recognizer.thresholded and proba < self.core.confidence):
+                    track["matricCode"], track["proba"] = None, 0.0
+                    track["confirmedAt"] = None
+                    continue
+                track["matricCode"], track["proba"] = matricCode, proba
+                track["confirmedAt"] = packet["now"] \
+                    if proba >= self.core.confirmConfidence else None
+                recognized.append((matricCode, proba))
+            packet["visible"] = self.__visible = [
+                (track["box"], track["matricCode"], track["proba"])
+                for track in self.tracker.visible()]
+        self.recognitionFps.update()
+
+        for (matricCode, proba) in recognized:
+            name = self.lookupLabel(matricCode)
+            if name:
+                print("DETECTED [%s] (confidence=%.2f%%)" %
+                      (name, proba * 100))
+
+            self.markAsPresent(matricCode)
+        return packet
+
+    def render(self, packet):
+        frame = packet["frame"]
+        for ((startX, startY, endX, endY), matricCode, proba) in packet["visible"]:
+            cv2.rectangle(frame, (startX, startY), (endX, endY),
+                          (194, 188, 200), 2)
+            name = matricCode and self.lookupLabel(matricCode)
+            if name:
+                # draw the bounding box of the face along with the
+                # associated probability
+                text = "{}: {:.2f}%".format(name, proba * 100)
+                y = startY - 10 if startY - 10 > 10 else startY + 10
+                cv2.putText(frame, text, (startX, y),
+                            cv2.FONT_HERSHEY_COMPLEX, 0.55, (0, 0, 256), 2)
+
+        # update the FPS counter
+        self.fps.update()
+
+        # the display scales and converts the frame as it needs to
+        return frame
+
+    def __timed(self, stage, handler, *args):
+        start = time.perf_counter()
+        result = handler(*args)
+        stats = self.__stats[stage]
+        stats["elapsed"] += time.perf_counter() - start
+        stats["processed"] += 1
+        return result
+
+    def __nextFrame(self):
+        # the latest camera frame, or None if it's already been captured
+        frame = self.vs.read()
+        if frame is None or frame is self.__lastFrame:
+            return None
+        self.__lastFrame = frame
+        return frame
+
+    def step(self):
+        # run the latest frame through every recognition stage on the
+        # calling thread, returning whether there was a new frame to
+        frame = self.__nextFrame()
+        if frame is None:
+            return False
+        packet = self.__timed("capture", self.capture, frame)
+        for stage in self.RECOGNITION_STAGES[1:]:
+            packet = self.__timed(stage, getattr(self, stage), packet)
+        return True
+
+    def __runSteps(self):
+        try:
+            while not self.__stopped.is_set():
+                if not self.step():
+                    time.sleep(0.001)
+        except Exception as err:
+            self.__error = err
+            self.__stopped.set()
+
+    def __runStage(self, stage, inbox, outbox):
+        try:
+            while not self.__stopped.is_set():
+                if inbox is None:
+                    # skip frames the video stream has already handed us
+                    frame = self.__nextFrame()
+                    if frame is None:
+                        time.sleep(0.001)
+                        continue
+                    packet = self.__timed(stage, self.capture, frame)
+                else:
+                    try:
+                        packet = inbox.get(timeout=0.1)
+                    except queue.Empty:
+                        continue
+                    packet = self.__timed(
+                        stage, getattr(self, stage), packet)
+                if outbox is not None:
+                    outbox.put(packet)
+        except Exception as err:
+            self.__error = err
+            self.__stopped.set()
+
+    def start(self, threaded=True):
+        if not threaded:
+            self.__threads.append(threading.Thread(
+                name="RecognitionPipeline", target=self.__runSteps, daemon=True))
+        stages = self.RECOGNITION_STAGES if threaded else ()
+        for (index, stage) in enumerate(stages):
+            self.__threads.append(threading.Thread(
+                name="RecognitionPipeline-%s" % stage,
+                target=self.__runStage,
+                args=(stage,
+                      self.queues[stage] if index else None,
+                      self.queues[stages[index + 1]] if index + 1 < len(stages) else None),
+                daemon=True))
+        for thread in self.__threads:
+            thread.start()
+
+    def preview(self, timeout=None):
+        # render the next camera frame with the latest recognized faces
+        # drawn over it, re-raising any error a stage hit
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if self.__error:
+                raise self.__error
+            frame = self.vs.read()
+            if frame is not None and frame is not self.__shownFrame:
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(0.001)
+        self.__shownFrame = frame
+        packet = {"frame": imutils.resize(frame, width=600),
+                  "visible": self.__visible}
+        return self.__timed("render", self.render, packet)
+
+    def stop(self):
+        self.__stopped.set()
+        for thread in self.__threads:
+            thread.join()
+        self.fps.stop()
+        self.recognitionFps.stop()
+
+    def stats(self):
+        return {
+            stage: {
+                "processed": stats["processed"],
+                "latency": stats["elapsed"] / (stats["processed"] or 1),
+                # how deep its queue ran, on average and at most, as items
+                # were queued
+                "depth": self.queues[stage].totalDepth / (self.queues[stage].puts or 1)
+                if stage in self.queues else 0,
+                "maxDepth": self.queues[stage].maxDepth if stage in self.queues else 0,
+                "dropped": self.queues[stage].dropped if stage in self.queues else 0,
+            }
+            for (stage, stats) in self.__stats.items()
+        }
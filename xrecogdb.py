@@ -0,0 +1,421 @@
+from contextlib import contextmanager
+import threading
+import queue
+import time
+
+
+class PooledConnection(object):
+    """
+    A database connection checked out of a Database, keeping a cursor per
+    statement so that statements run again on the same connection reuse
+    their prepared form instead of being prepared anew.
+    """
+
+    def __init__(self, connection, *, paramstyle, cursorOpts):
+        self.connection = connection
+        self.paramstyle = paramstyle
+        self.cursorOpts = cursorOpts
+        self.__cursors = {}
+
+    def cursor(self, sql):
+        # statements are written with %s placeholders, translated here
+        # for drivers taking ? instead
+        if self.paramstyle == "qmark":
+            sql = sql.replace("%s", "?")
+        if sql not in self.__cursors:
+            self.__cursors[sql] = (
+                self.connection.cursor(**self.cursorOpts), sql)
+        return self.__cursors[sql]
+
+    def execute(self, sql, params=()):
+        (cursor, sql) = self.cursor(sql)
+        cursor.execute(sql, tuple(params))
+        return cursor
+
+    def query(self, sql, params=()):
+        return self.execute(sql, params).fetchall()
+
+    def stream(self, sql, params=(), size=1000):
+        # yield the rows of `sql` `size` at a time off a cursor of its own,
+        # left unbuffered so rows are only pulled as they're consumed
+        if self.paramstyle == "qmark":
+            sql = sql.replace("%s", "?")
+        cursor = self.connection.cursor(**self.cursorOpts)
+        try:
+            cursor.execute(sql, tuple(params))
+            while True:
+                rows = cursor.fetchmany(size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+
+    def commit(self):
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def close(self):
+        for (cursor, _) in self.__cursors.values():
+            try:
+                cursor.close()
+            except Exception:
+                pass
+        self.__cursors.clear()
+        self.connection.close()
+
+
+class Database(object):
+    """
+    A bounded pool of at most `size` connections opened on demand through
+    `connect()`. Each thread checks a connection out for the span of a
+    transaction() (nested ones on the same thread share it), so threads
+    no longer queue up behind a single shared socket, and blocks for at
+    most `timeout` seconds when every connection is in use.
+
+    `paramstyle` and `cursorOpts` adapt it to the driver, e.g. "pyformat"
+    and {"prepared": True} for MySQL, or "qmark" and {} for SQLite.
+    """
+
+    def __init__(self, connect, *, size=4, paramstyle="pyformat", cursorOpts=None, timeout=None):
+        self.connect = connect
+        self.size = size
+        self.paramstyle = paramstyle
+        self.cursorOpts = cursorOpts or {}
+        self.timeout = timeout
+        self.__slots = threading.BoundedSemaphore(size)
+        self.__idle = queue.LifoQueue()
+        self.__local = threading.local()
+
+    def __checkout(self):
+        if not self.__slots.acquire(timeout=self.timeout):
+            raise TimeoutError(
+                "no database connection freed up in %ss" % self.timeout)
+        try:
+            return self.__idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            return PooledConnection(
+                self.connect(), paramstyle=self.paramstyle, cursorOpts=self.cursorOpts)
+        except BaseException:
+            self.__slots.release()
+            raise
+
+    def __checkin(self, connection, broken):
+        try:
+            if broken:
+                connection.close()
+            else:
+                self.__idle.put(connection)
+        finally:
+            self.__slots.release()
+
+    @contextmanager
+    def transaction(self):
+        # check out a connection for the current thread, committing when
+        # the outermost transaction completes and rolling back if it fails
+        connection = getattr(self.__local, "connection", None)
+        if connection is not None:
+            yield connection
+            return
+        connection = self.__local.connection = self.__checkout()
+        broken = False
+        try:
+            yield connection
+            connection.commit()
+        except BaseException:
+            try:
+                connection.rollback()
+            except Exception:
+                # the connection itself is gone, don't hand it out again
+                broken = True
+            raise
+        finally:
+            self.__local.connection = None
+            self.__checkin(connection, broken)
+
+    def execute(self, sql, params=()):
+        # run a single statement in its own transaction
+        with self.transaction() as connection:
+            return connection.execute(sql, params).rowcount
+
+    def query(self, sql, params=()):
+        with self.transaction() as connection:
+            return connection.query(sql, params)
+
+    def stream(self, sql, params=(), size=1000):
+        # fetch the rows `size` at a time on a connection checked out for
+        # them alone, rather than the thread's transaction connection, so
+        # that the consumer can run statements of its own between chunks
+        # and the generator may be finished on any thread
+        connection = self.__checkout()
+        (exhausted, broken) = (False, True)
+        try:
+            yield from connection.stream(sql, params, size)
+            exhausted = True
+        finally:
+            try:
+                connection.rollback()
+                # a cursor left with unread rows would hold the
+                # connection up, so only hand it out again once drained
+                broken = not exhausted
+            except Exception:
+                pass
+            self.__checkin(connection, broken)
+
+    def close(self):
+        # close the idle connections, those checked out are closed as
+        # they're returned
+        while True:
+            try:
+                self.__idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class MatricIndex(object):
+    """
+    The matric codes known to be registered, answering whether one is
+    taken without a database round-trip. Codes it hasn't seen are looked
+    up through `lookup(matricCode)`, as they may have been registered
+    elsewhere since the roster was loaded, and remembered if they are.
+    """
+
+    def __init__(self, lookup, known=()):
+        self.lookup = lookup
+        self.__codes = set(known)
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__codes)
+
+    def add(self, matricCode):
+        with self.__lock:
+            self.__codes.add(matricCode)
+
+    def update(self, matricCodes):
+        with self.__lock:
+            self.__codes.update(matricCodes)
+
+    def exists(self, matricCode):
+        with self.__lock:
+            if matricCode in self.__codes:
+                return True
+        if self.lookup(matricCode):
+            self.add(matricCode)
+            return True
+        return False
+
+
+class AttendanceWriter(object):
+    """
+    Records students as present off the recognition loop. mark() only
+    touches in-memory sets: codes already marked this session are dropped
+    there and then, while new ones are coalesced and written by a
+    background thread as one multi-row UPDATE in a single transaction at
+    most every `interval` seconds, so recognition never waits on the
+    database.
+    """
+
+    # most matric codes bound into a single UPDATE statement
+    BATCH_SIZE = 500
+
+    def __init__(self, database, *, interval=0.25, errorHandler=None):
+        self.database = database
+        self.interval = interval
+        self.errorHandler = errorHandler
+        self.__marked = set()
+        self.__pending = set()
+        self.__lock = threading.Lock()
+        self.__flushLock = threading.Lock()
+        self.__wakeup = threading.Event()
+        self.__closed = False
+        self.__thread = threading.Thread(
+            name="AttendanceWriter", target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def mark(self, matricCode):
+        # queue `matricCode` to be marked present, returning whether it
+        # wasn't already marked this session
+        with self.__lock:
+            if matricCode in self.__marked:
+                return False
+            self.__marked.add(matricCode)
+            self.__pending.add(matricCode)
+        self.__wakeup.set()
+        return True
+
+    def reset(self):
+        # mark every student absent in the database and forget every mark,
+        # holding off flushes until both are done so none can land between
+        # the two and be wiped while still counted as written
+        with self.__flushLock:
+            self.database.execute(
+                "UPDATE attendees SET isPresent = 0 WHERE isPresent = 1;")
+            with self.__lock:
+                self.__marked.clear()
+                self.__pending.clear()
+
+    def __run(self):
+        while not self.__closed:
+            self.__wakeup.wait()
+            # give the marks of the next few frames a chance to coalesce
+            # into the same write
+            if not self.__closed:
+                time.sleep(self.interval)
+            self.__wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        # write every pending mark in one transaction
+        with self.__flushLock:
+            with self.__lock:
+                (pending, self.__pending) = (self.__pending, set())
+            if not pending:
+                return
+            codes = sorted(pending)
+            try:
+                with self.database.transaction() as connection:
+                    for start in range(0, len(codes), self.BATCH_SIZE):
+                        batch = codes[start:start + self.BATCH_SIZE]
+                        connection.execute(
+                            "UPDATE attendees SET isPresent = 1 WHERE matricCode IN (%s);" %
+                            ", ".join(["%s"] * len(batch)), batch)
+            except Exception as err:
+                # put the marks back to be retried on the next flush
+                with self.__lock:
+                    self.__pending |= pending
+                self.__wakeup.set()
+                if self.errorHandler:
+                    self.errorHandler(err)
+                else:
+                    raise
+
+    def close(self):
+        # stop the writer thread, writing out any pending marks
+        self.__closed = True
+        self.__wakeup.set()
+        self.__thread.join()
+        self.flush()
+
+
+if __name__ == "__main__":
+    import tempfile
+    import sqlite3
+    import os
+
+    def newDatabase(path, size):
+        return Database(
+            lambda: sqlite3.connect(path, timeout=30, check_same_thread=False),
+            size=size, paramstyle=sqlite3.paramstyle)
+
+    def test1(path):
+        print("[\x1b[32mtest1\x1b[0m]: pooled connections are bounded and reused")
+        database = newDatabase(path, 2)
+        database.execute(
+            "CREATE TABLE attendees (matricCode TEXT PRIMARY KEY, isPresent INTEGER);")
+        held = []
+
+        def worker(index):
+            with database.transaction() as connection:
+                held.append(connection)
+                # nested transactions on a thread share its connection
+                with database.transaction() as nested:
+                    assert nested is connection
+                connection.execute(
+                    "INSERT INTO attendees VALUES (%s, %s);", ("m%03d" % index, 0))
+                time.sleep(0.01)
+
+        threads = [threading.Thread(target=worker, args=(index,))
+                   for index in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        connections = len(set(map(id, held)))
+        print(" * 20 transactions over %d connection(s)" % connections)
+        assert connections <= 2
+        assert database.query("SELECT COUNT(*) FROM attendees;")[0][0] == 20
+        chunks = [len(rows) for rows in database.stream(
+            "SELECT * FROM attendees WHERE matricCode != %s;", ("m000",), 8)]
+        print(" * streamed 19 rows in chunks of %s" % chunks)
+        assert chunks == [8, 8, 3]
+        # statements run between chunks don't touch the stream's connection,
+        # which is released even when it's abandoned part way
+        for rows in database.stream("SELECT * FROM attendees;", (), 8):
+            assert database.query("SELECT COUNT(*) FROM attendees;")[0][0] == 20
+            break
+        with database.transaction():
+            assert sum(len(rows) for rows in database.stream(
+                "SELECT * FROM attendees;", (), 8)) == 20
+        database.close()
+
+    def test2(path):
+        print("[\x1b[32mtest2\x1b[0m]: failed transactions roll back")
+        database = newDatabase(path, 2)
+        try:
+            with database.transaction() as connection:
+                connection.execute(
+                    "UPDATE attendees SET isPresent = 1;")
+                raise RuntimeError("abort")
+        except RuntimeError:
+            pass
+        assert database.query(
+            "SELECT COUNT(*) FROM attendees WHERE isPresent = 1;")[0][0] == 0
+        print(" * rolled back")
+        database.close()
+
+    def test4():
+        print("[\x1b[32mtest4\x1b[0m]: unknown matric codes are looked up, and kept if taken")
+        lookups = []
+
+        def lookup(matricCode):
+            lookups.append(matricCode)
+            return matricCode == "m100"
+
+        index = MatricIndex(lookup, ("0000",))
+        index.update(["m%03d" % code for code in range(10)])
+        assert index.exists("0000") and index.exists("m005")
+        assert index.exists("m100") and index.exists("m100")
+        assert not index.exists("m200") and not index.exists("m200")
+        print(" * %d lookup(s) for %s" % (len(lookups), lookups))
+        assert lookups == ["m100", "m200", "m200"]
+
+    def test3(path):
+        print("[\x1b[32mtest3\x1b[0m]: attendance marks are deduplicated and batched")
+        database = newDatabase(path, 2)
+        writer = AttendanceWriter(database, interval=0.05)
+        marked = sum(writer.mark("m%03d" % (index % 10))
+                     for index in range(1000))
+        writer.close()
+        present = database.query(
+            "SELECT COUNT(*) FROM attendees WHERE isPresent = 1;")[0][0]
+        print(" * %d new marks out of 1000, %d students present" %
+              (marked, present))
+        assert marked == present == 10
+        writer = AttendanceWriter(database, interval=0.05)
+        writer.reset()
+        assert writer.mark("m000")
+        writer.close()
+        present = database.query(
+            "SELECT COUNT(*) FROM attendees WHERE isPresent = 1;")[0][0]
+        print(" * %d student(s) present after a reset and a new mark" % present)
+        assert present == 1
+        database.close()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "xrecog.sqlite")
+        print("Running test 1")
+        test1(path)
+        print()
+        print("Running test 2")
+        test2(path)
+        print()
+        print("Running test 3")
+        test3(path)
+    print()
+    print("Running test 4")
+    test4()
@@ -0,0 +1,280 @@
+from itertools import chain
+import numpy as np
+import threading
+import struct
+import zlib
+import re
+import os
+
+
+def fsyncDirectory(path):
+    # make a rename within `path` durable, where the platform supports it
+    if hasattr(os, "O_DIRECTORY"):
+        fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def atomicWrite(file, write):
+    # write `file` through `write(f)` to a temporary file, then rename it
+    # over `file` so readers only ever see the previous or the new version
+    tmpFile = file + ".tmp"
+    with open(tmpFile, "wb") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmpFile, file)
+    fsyncDirectory(os.path.dirname(file) or ".")
+
+
+class EmbeddingStore(object):
+    """
+    The enrolled face embeddings, kept on disk in a directory holding
+
+     * `gallery-<generation>.npy`: a snapshot of the vectors as a plain
+       (N, dim) float32 matrix, with the rows of each label kept together,
+       opened memory-mapped so that loading it doesn't read it into memory
+     * `gallery-<generation>.index`: the labels of that snapshot along with
+       the offset of each one's first row, published once the snapshot is
+       complete
+     * `gallery-<generation>.journal`: append-only logs of the records
+       added since that snapshot, each a little-endian uint32 label length,
+       a uint32 CRC-32 of the rest of the record, the UTF-8 label and the
+       float32 vector
+
+    A record torn or garbled by a crash mid-append fails its checksum and
+    is dropped, along with anything after it, on the next load. compact()
+    starts a new journal generation, folds the older journals into a new
+    snapshot without blocking appends, publishes it by writing its index
+    and only then removes the older generations, so a crash at any point
+    leaves a consistent gallery behind.
+    """
+
+    RECORD_HEADER = struct.Struct("<II")
+
+    FILE_PATTERN = re.compile(r"^gallery-(\d+)\.(npy|index|journal)$")
+
+    def __init__(self, path, dim=128, compactThreshold=4096):
+        self.path = path
+        self.dim = dim
+        self.compactThreshold = compactThreshold
+        self.__lock = threading.RLock()
+        self.__compactLock = threading.Lock()
+        if not os.path.exists(path):
+            print(
+                "[INFO] embedding store [%s] doesn't exist, attempting to create..." % path)
+            os.makedirs(path)
+        self.load()
+
+    def __file(self, generation, kind):
+        return os.path.join(self.path, "gallery-%06d.%s" % (generation, kind))
+
+    def __generations(self, kind):
+        return sorted(
+            int(match.group(1))
+            for match in map(self.FILE_PATTERN.match, os.listdir(self.path))
+            if match and match.group(2) == kind)
+
+    def __remove(self, generation, kinds):
+        for kind in kinds:
+            try:
+                os.remove(self.__file(generation, kind))
+            except FileNotFoundError:
+                pass
+            except OSError:
+                # still mapped by a recognizer on platforms that won't
+                # remove open files, it's cleaned up on the next load
+                pass
+
+    def load(self):
+        with self.__lock:
+            snapshots = self.__generations("index")
+            base = snapshots[-1] if snapshots else 0
+            self.__openSnapshot(base if snapshots else None)
+
+            # remove generations and partial snapshots left behind by an
+            # interrupted compaction
+            for name in os.listdir(self.path):
+                if name.endswith(".tmp"):
+                    os.remove(os.path.join(self.path, name))
+            for generation in self.__generations("npy"):
+                if generation != base or not snapshots:
+                    self.__remove(generation, ("npy",))
+            for generation in snapshots[:-1]:
+                self.__remove(generation, ("index",))
+            for generation in self.__generations("journal"):
+                if generation < base:
+                    self.__remove(generation, ("journal",))
+
+            (self.__journalLabels, self.__journalVectors) = ([], [])
+            journals = self.__generations("journal")
+            for generation in journals:
+                self.__readJournal(self.__file(generation, "journal"))
+            self.generation = max([base, *journals])
+            self.__indexJournal()
+
+    def __openSnapshot(self, generation):
+        # map the snapshot of `generation`, reading only its index, which
+        # holds a row span per label rather than a label per row
+        if generation is None:
+            (self.__snapshot, self.__classes, self.__spans) = (
+                np.empty((0, self.dim), dtype="<f4"), [], {})
+            return
+        with np.load(self.__file(generation, "index")) as index:
+            classes = bytes(index["labels"]).decode().split("\n")
+            offsets = index["offsets"].tolist()
+        self.__snapshot = np.load(self.__file(generation, "npy"), mmap_mode="r")
+        self.__classes = classes
+        self.__spans = {label: (offsets[i], offsets[i + 1])
+                        for (i, label) in enumerate(classes)}
+
+    def __indexJournal(self):
+        self.__journalRows = {}
+        for (row, label) in enumerate(self.__journalLabels):
+            self.__journalRows.setdefault(label, []).append(row)
+
+    def __readJournal(self, journalPath):
+        with open(journalPath, "rb") as f:
+            journal = f.read()
+        (offset, header, vectorSize) = (
+            0, self.RECORD_HEADER.size, 4 * self.dim)
+        while offset + header <= len(journal):
+            (labelSize, checksum) = self.RECORD_HEADER.unpack_from(
+                journal, offset)
+            end = offset + header + labelSize + vectorSize
+            if end > len(journal) or zlib.crc32(journal[offset + header:end]) != checksum:
+                break
+            self.__journalLabels.append(
+                journal[offset + header:offset + header + labelSize].decode())
+            self.__journalVectors.append(np.frombuffer(
+                journal, dtype="<f4", count=self.dim, offset=offset + header + labelSize))
+            offset = end
+        if offset < len(journal):
+            # drop the record torn by an interrupted append
+            print("[WARN] discarding %d bytes of incomplete records from [%s]" % (
+                len(journal) - offset, journalPath))
+            os.truncate(journalPath, offset)
+
+    def __len__(self):
+        with self.__lock:
+            return len(self.__snapshot) + len(self.__journalLabels)
+
+    def append(self, label, vectors):
+        label = str(label)
+        assert "\n" not in label, "labels can't span lines"
+        vectors = np.asarray(vectors, dtype="<f4").reshape(-1, self.dim)
+        encoded = label.encode()
+        records = b"".join(
+            self.RECORD_HEADER.pack(len(encoded), zlib.crc32(body)) + body
+            for body in (encoded + vector.tobytes() for vector in vectors))
+        with self.__lock:
+            with open(self.__file(self.generation, "journal"), "ab") as f:
+                f.write(records)
+                f.flush()
+                os.fsync(f.fileno())
+            rows = self.__journalRows.setdefault(label, [])
+            for vector in vectors:
+                rows.append(len(self.__journalLabels))
+                self.__journalLabels.append(label)
+                self.__journalVectors.append(vector)
+
+    def count(self, label):
+        with self.__lock:
+            (start, stop) = self.__spans.get(label, (0, 0))
+            return stop - start + len(self.__journalRows.get(label, []))
+
+    def counts(self):
+        with self.__lock:
+            counts = {label: stop - start
+                      for (label, (start, stop)) in self.__spans.items()}
+            for (label, rows) in self.__journalRows.items():
+                counts[label] = counts.get(label, 0) + len(rows)
+            return counts
+
+    def vectors(self, label, start=0, stop=None):
+        # the vectors enrolled for `label`, in the order they were added
+        with self.__lock:
+            (first, last) = self.__spans.get(label, (0, 0))
+            journal = [self.__journalVectors[row]
+                       for row in self.__journalRows.get(label, [])]
+            vectors = np.concatenate([
+                self.__snapshot[first:last],
+                np.array(journal, dtype="<f4").reshape(-1, self.dim)])
+            return vectors[start:stop].astype("float32")
+
+    def snapshot(self):
+        # the snapshot as (labels, the index into them of each row, the
+        # memory-mapped (N, dim) matrix itself), without copying it
+        with self.__lock:
+            (classes, snapshot) = (list(self.__classes), self.__snapshot)
+            sizes = [self.__spans[label][1] - self.__spans[label][0]
+                     for label in classes]
+        labels = np.repeat(np.arange(len(classes), dtype="int32"), sizes)
+        return (classes, labels, snapshot)
+
+    def journal(self):
+        # the records added since the snapshot, as a list of labels and a
+        # (N, dim) float32 matrix of their vectors
+        with self.__lock:
+            return (list(self.__journalLabels),
+                    np.array(self.__journalVectors, dtype="float32").reshape(-1, self.dim))
+
+    def compact(self, force=False):
+        # fold the journals into the snapshot of a new generation, once
+        # they've grown past `compactThreshold` records unless forced
+        with self.__compactLock:
+            with self.__lock:
+                if not self.__journalLabels \
+                        or (not force and len(self.__journalLabels) < self.compactThreshold):
+                    return
+
+                # rotate the journal, so that appends made while we write
+                # the snapshot land in the new generation
+                (snapshot, spans) = (self.__snapshot, self.__spans)
+                classes = list(dict.fromkeys(
+                    chain(self.__classes, self.__journalLabels)))
+                journalRows = {label: list(rows)
+                               for (label, rows) in self.__journalRows.items()}
+                journalVectors = list(self.__journalVectors)
+                absorbed = len(self.__journalLabels)
+                self.generation += 1
+                generation = self.generation
+
+            # stream every label's rows out in turn, straight from the
+            # mapped snapshot, rather than building the matrix in memory
+            offsets = [0]
+            for label in classes:
+                (start, stop) = spans.get(label, (0, 0))
+                offsets.append(offsets[-1] + stop - start +
+                               len(journalRows.get(label, [])))
+
+            def writeSnapshot(f):
+                np.lib.format.write_array_header_1_0(f, {
+                    "descr": "<f4", "fortran_order": False, "shape": (offsets[-1], self.dim)})
+                for label in classes:
+                    (start, stop) = spans.get(label, (0, 0))
+                    f.write(np.ascontiguousarray(snapshot[start:stop]).tobytes())
+                    for row in journalRows.get(label, []):
+                        f.write(journalVectors[row].tobytes())
+
+            def writeIndex(f):
+                np.savez(f, labels=np.frombuffer("\n".join(classes).encode(), dtype="uint8"),
+                         offsets=np.array(offsets, dtype="int64"))
+
+            atomicWrite(self.__file(generation, "npy"), writeSnapshot)
+            atomicWrite(self.__file(generation, "index"), writeIndex)
+
+            # the journal rows absorbed by the snapshot are dropped, those
+            # appended since stay behind in the new generation's journal
+            with self.__lock:
+                self.__openSnapshot(generation)
+                del self.__journalLabels[:absorbed]
+                del self.__journalVectors[:absorbed]
+                self.__indexJournal()
+                for older in sorted(set(self.__generations("npy") +
+                                        self.__generations("index") +
+                                        self.__generations("journal"))):
+                    if older < generation:
+                        self.__remove(older, ("npy", "index", "journal"))